@@ -1,43 +1,45 @@
 import os
-import shutil
+import sys
 import logging
+import argparse
 import tkinter as tk
-from tkinter import messagebox
-from wiiman.validator import select_and_validate_folder
-from wiiman.rename import rename_extensionless_files
-from wiiman.tmd_handler import handle_tmd_logic
-from wiiman.tmd_parser import read_tmd_title_id
-from wiiman.match_title_id import match_title_id_exact
+from tkinter import filedialog, messagebox
+from wiiman.validator import select_and_validate_folder, is_valid_cdn_folder
 from wiiman.about_menu import add_about_menu
-from wiiman.decrypt_utils import generate_fake_tik
+from wiiman.pipeline import prepare_cdn_folder, decrypt_cdn_folder, sanitize_name, open_ticket_cache
+from wiiman.title_group import group_cdn_folders, process_family
+from wiiman.progress import Progress, LogSink, TkSink
+from wiiman.ticket_cache import format_invalid_rows
+from wiiman.preflight import plan_library, format_plan, blocking_problems
 
 # 📋 Logging setup
 logging.basicConfig(level=logging.DEBUG)
 
+def make_progress(window=None):
+    """Progress reporter logging every event and mirroring it in the window's status line."""
+    progress = Progress(LogSink())
+    status = getattr(window, "status_var", None)
+    if status is not None:
+        progress.add_sink(TkSink(window, status))
+    return progress
+
 def dorun(window=None):
     selected_path = select_and_validate_folder()
     if not selected_path:
         return
 
     logging.info(f"Selected folder: {selected_path}")
+    progress = make_progress(window)
 
-    # Step 1: Rename extensionless files
-    rename_extensionless_files(selected_path)
-
-    # Step 2: Handle title.tmd and fallback logic
-    handle_tmd_logic(selected_path)
-
-    # Step 3: Parse Title ID from title.tmd
-    tmd_path = os.path.join(selected_path, "title.tmd")
+    # 🔍 Preflight: catch missing keys, contents or space before touching anything
+    problems = blocking_problems(plan_library(selected_path))
+    if problems:
+        messagebox.showerror("Preflight Failed", "\n".join(problems))
+        return
 
+    # Steps 1-3: Rename files, resolve title.tmd, match the key and build title.tik
     try:
-        title_id = read_tmd_title_id(tmd_path)
-        logging.info(f"📦 Extracted Title ID: {title_id}")
-
-        wiiman_dir = os.path.abspath(os.path.dirname(__file__))  # safer root
-        csv_path = os.path.join(wiiman_dir, "wiiman", "wiiu_titlekeys.csv")
-
-        matched = match_title_id_exact(title_id, csv_path)
+        title_id, matched = prepare_cdn_folder(selected_path, progress)
         if matched:
             messagebox.showinfo(
                 "🎯 Match Found",
@@ -46,17 +48,6 @@ def dorun(window=None):
             logging.info(f"🎮 Game Name: {matched['Name']}")
             logging.info(f"🆔 Title ID: {matched['Title ID']}")
             logging.info(f"🔐 Title Key: {matched['Title Key']}")
-
-            class SimpleUI:
-                def update(self, msg):
-                    logging.info(msg)
-
-            generate_fake_tik(
-                title_id=matched["Title ID"],
-                title_key=matched["Title Key"],
-                output_path=selected_path,
-                ui=SimpleUI()
-            )
         else:
             messagebox.showwarning("Match Failed", f"No match found for Title ID: {title_id}")
             return
@@ -64,28 +55,16 @@ def dorun(window=None):
     except Exception as e:
         messagebox.showerror("TMD Parsing Error", str(e))
         return
-    
-    from wiiman.decrypt_utils import run_cdecrypt
 
     # 🔓 Decrypt into a sibling folder named after the game
-    game_name = matched["Name"].replace(":", "").replace("/", "-").strip()  # Sanitized
+    game_name = sanitize_name(matched["Name"])
     parent_dir = os.path.dirname(selected_path)
     output_dir = os.path.join(parent_dir, game_name)
 
-    os.makedirs(output_dir, exist_ok=True)
-
-    class SimpleUI:
-        def update(self, msg):
-            logging.info(msg)
-
-    decryptor_path = os.path.join(os.path.dirname(__file__), "wiiman", "cdecrypt.exe")
-
-    run_cdecrypt(decryptor_path, selected_path, output_dir, SimpleUI())
-
-    # Step 5: Copy title.cert template
-    src = os.path.join(os.path.dirname(__file__), "template", "title.cert")
-    dst = os.path.join(selected_path, "title.cert")
-    shutil.copy2(src, dst)
+    # Steps 4-5: Decrypt and copy the title.cert template
+    if not decrypt_cdn_folder(selected_path, output_dir, progress):
+        messagebox.showerror("Decryption Failed", "The decryptor did not produce any files, see the log for details.")
+        return
 
     # Final message
     messagebox.showinfo("Complete", "Operation completed successfully!")
@@ -93,16 +72,91 @@ def dorun(window=None):
         window.quit()
         window.destroy()
 
-def main():
+def dorun_library(window=None):
+    """Processes every CDN folder of a library, merging base, update and DLC per game."""
+    library = filedialog.askdirectory(title="Select Wii U CDN Library", initialdir=os.getcwd())
+    if not library:
+        return
+
+    folders = [
+        os.path.join(library, name) for name in sorted(os.listdir(library))
+        if is_valid_cdn_folder(os.path.join(library, name))
+    ]
+    families = group_cdn_folders(folders)
+    logging.info(f"📚 Found {len(families)} title famil(ies) in {len(folders)} folder(s)")
+
+    progress = make_progress(window)
+    # 🎫 Every key is validated when the cache is built, list the bad rows on every run
+    cache = open_ticket_cache()
+    if cache is not None and cache.invalid:
+        progress.warning(f"{len(cache.invalid)} invalid key database row(s):\n"
+                         + "\n".join(format_invalid_rows(cache.invalid)))
+    failed = []
+
+    # 🔍 Preflight the whole library, blocked families are skipped untouched
+    plans = {plan["folder"]: plan for plan in plan_library(library)}
+    logging.info(format_plan(plans.values()))
+
+    for family, layers in families.items():
+        problems = blocking_problems([plans[layer["folder"]] for layer in layers])
+        if problems:
+            progress.error(f"Skipping family {family}: " + "; ".join(problems))
+            failed.append(family)
+            continue
+
+        try:
+            names = {}
+            for layer in layers:
+                # No "Use title.tmd?" dialog per folder in a library run
+                title_id, matched = prepare_cdn_folder(layer["folder"], progress, interactive=False)
+                if not matched:
+                    raise ValueError(f"No match found for Title ID: {title_id}")
+                names[layer["type"]] = matched["Name"]
+
+            game_name = sanitize_name(names.get("base") or next(iter(names.values())))
+            output_dir = os.path.join(library, game_name)
+            process_family(
+                layers, output_dir,
+                lambda layer, staging: decrypt_cdn_folder(layer["folder"], staging, progress, incremental=False),
+                progress
+            )
+        except Exception as e:
+            progress.error(f"Failed family {family}: {e}")
+            failed.append(family)
+
+    if failed:
+        messagebox.showwarning("Library", f"{len(failed)} title famil(ies) could not be processed:\n" + "\n".join(failed))
+    else:
+        messagebox.showinfo("Complete", f"Processed {len(families)} title famil(ies).")
+
+def dry_run(path, output_root=None):
+    """Prints the preflight plan of a CDN folder or library. Returns 1 if anything is blocked."""
+    plans = plan_library(path, output_root)
+    print(format_plan(plans))
+    return 1 if any(plan["problems"] for plan in plans) else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Wii U CDN processor")
+    parser.add_argument("--dry-run", metavar="PATH",
+                        help="plan a CDN folder or library from its metadata only, without touching it")
+    parser.add_argument("--output", metavar="DIR",
+                        help="parent folder of the outputs for --dry-run (default: next to the CDN folders)")
+    args = parser.parse_args(argv)
+    if args.dry_run:
+        return dry_run(args.dry_run, args.output)
+
     window = tk.Tk()
     window.title("🧩 WiiU CDN Processor")
-    window.geometry("400x180")
+    window.geometry("400x250")
+    window.status_var = tk.StringVar(window, "Idle")
 
     add_about_menu(window)  # ✅ Adds Help > About to menu bar
 
     tk.Label(window, text="Select folder to process:", font=("Segoe UI", 12)).pack(pady=20)
     tk.Button(window, text="📁 Select Folder", width=25, command=lambda: dorun(window)).pack(pady=10)
+    tk.Button(window, text="📚 Process Library", width=25, command=lambda: dorun_library(window)).pack(pady=5)
+    tk.Label(window, textvariable=window.status_var, font=("Segoe UI", 9)).pack(pady=5)
     window.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,227 @@
+import os
+import stat
+import struct
+import tempfile
+import pytest
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from wiiman.tmd_parser import read_tmd_contents
+from wiiman.delta import record_state, apply_delta, diff_contents, load_state, write_state
+from wiiman import pipeline
+from wiiman.progress import Progress, ListSink, ERROR
+from wiiman.pipeline import decrypt_cdn_folder
+
+TITLE_ID = '000500001010F300'
+
+def create_file(path, content=b''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+def create_tmd(path, contents, version=0):
+    """contents: list of (content_id, index, size, sha1_byte)"""
+    tmd = bytearray(0xB04 + 0x30 * len(contents))
+    tmd[0x18C:0x18C + 8] = bytes.fromhex(TITLE_ID)
+    struct.pack_into('>HH', tmd, 0x1DC, version, len(contents))
+    for n, (content_id, index, size, sha) in enumerate(contents):
+        offset = 0xB04 + 0x30 * n
+        struct.pack_into('>IHHQ', tmd, offset, content_id, index, 0x2003, size)
+        tmd[offset + 0x10:offset + 0x24] = bytes([sha]) * 20
+    create_file(path, bytes(tmd))
+
+# Files produced by each content index in the fake decryptor
+LAYOUT = {
+    0: [],
+    1: ['code/app.rpx'],
+    2: ['content/a.bin', 'content/b.bin'],
+    3: ['content/c.bin'],
+}
+
+def make_decrypt(calls, tag):
+    def decrypt(cdn_folder, out_dir):
+        names = os.listdir(cdn_folder)
+        calls.append(sorted(names))
+        for index, files in LAYOUT.items():
+            if f'{index:08x}.app' in names:
+                for rel in files:
+                    create_file(os.path.join(out_dir, rel), tag)
+    return decrypt
+
+def create_cdn(folder, contents, version):
+    create_tmd(os.path.join(folder, 'title.tmd'), contents, version)
+    create_file(os.path.join(folder, 'title.tik'), b'tik')
+    for content_id, _index, _size, _sha in contents:
+        create_file(os.path.join(folder, f'{content_id:08x}.app'), b'x')
+
+def test_read_tmd_contents():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'title.tmd')
+        create_tmd(path, [(0, 0, 0x8000, 1), (0xA, 1, 12345, 2)], version=32)
+        contents = read_tmd_contents(path)
+        assert [c['id'] for c in contents] == ['00000000', '0000000A']
+        assert contents[1]['size'] == 12345
+        assert contents[1]['hash'] == '02' * 20
+
+def test_diff_contents():
+    old = {'0': {'id': '00000000', 'size': 1, 'hash': 'A'},
+           '1': {'id': '00000001', 'size': 1, 'hash': 'A'},
+           '2': {'id': '00000002', 'size': 1, 'hash': 'A'}}
+    new = [{'index': 0, 'id': '00000000', 'size': 1, 'hash': 'A'},
+           {'index': 1, 'id': '00000001', 'size': 2, 'hash': 'B'},
+           {'index': 3, 'id': '00000003', 'size': 1, 'hash': 'A'}]
+    assert diff_contents(old, new) == {'added': [3], 'changed': [1], 'removed': [2], 'unchanged': [0]}
+
+def test_apply_delta_decrypts_only_changed_contents():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cdn = os.path.join(tmpdir, 'cdn')
+        out = os.path.join(tmpdir, 'out')
+        calls = []
+
+        v1 = [(0, 0, 10, 1), (1, 1, 10, 1), (2, 2, 10, 1)]
+        create_cdn(cdn, v1, 0)
+        assert apply_delta(cdn, out, make_decrypt(calls, b'v1'), Progress()) is None
+        make_decrypt(calls, b'v1')(cdn, out)
+        record_state(out, os.path.join(cdn, 'title.tmd'))
+
+        # v2 changes content 1 and adds content 3
+        v2 = [(0, 0, 10, 1), (1, 1, 11, 2), (2, 2, 10, 1), (3, 3, 10, 1)]
+        create_cdn(cdn, v2, 16)
+        diff = apply_delta(cdn, out, make_decrypt(calls, b'v2'), Progress(), partial=True)
+
+        assert diff['changed'] == [1] and diff['added'] == [3]
+        assert calls[-1] == ['00000000.app', '00000001.app', '00000003.app', 'title.tik', 'title.tmd']
+        with open(os.path.join(out, 'code', 'app.rpx'), 'rb') as f:
+            assert f.read() == b'v2'
+        with open(os.path.join(out, 'content', 'a.bin'), 'rb') as f:
+            assert f.read() == b'v1'
+        assert os.path.exists(os.path.join(out, 'content', 'c.bin'))
+        assert not os.path.exists(os.path.join(cdn, '.delta'))
+
+        state = load_state(out)
+        assert state['version'] == 16
+        assert 'content/c.bin' in state['files']
+
+        # Same TMD again: nothing to do
+        assert apply_delta(cdn, out, make_decrypt(calls, b'v3'), Progress())['changed'] == []
+        assert len(calls) == 2
+
+def test_removed_content_files_are_deleted():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cdn = os.path.join(tmpdir, 'cdn')
+        out = os.path.join(tmpdir, 'out')
+        calls = []
+
+        v1 = [(0, 0, 10, 1), (1, 1, 10, 1), (2, 2, 10, 1), (3, 3, 10, 1)]
+        create_cdn(cdn, v1, 0)
+        make_decrypt(calls, b'v1')(cdn, out)
+        record_state(out, os.path.join(cdn, 'title.tmd'))
+
+        # v2 drops content 3, so its file table (content 0) changes too
+        v2 = [(0, 0, 11, 2), (1, 1, 10, 1), (2, 2, 10, 1)]
+        os.remove(os.path.join(cdn, '00000003.app'))
+        create_cdn(cdn, v2, 16)
+        diff = apply_delta(cdn, out, make_decrypt(calls, b'v2'), Progress())
+
+        assert diff['removed'] == [3]
+        assert calls[-1] == ['00000000.app', '00000001.app', '00000002.app', 'title.tik', 'title.tmd']
+        assert not os.path.exists(os.path.join(out, 'content', 'c.bin'))
+        assert os.path.exists(os.path.join(out, 'content', 'a.bin'))
+        assert 'content/c.bin' not in load_state(out)['files']
+
+def test_decryptor_needing_the_whole_folder_decrypts_it_once():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cdn = os.path.join(tmpdir, 'cdn')
+        out = os.path.join(tmpdir, 'out')
+        calls = []
+
+        create_cdn(cdn, [(0, 0, 10, 1), (1, 1, 10, 1), (2, 2, 10, 1)], 0)
+        make_decrypt(calls, b'v1')(cdn, out)
+        create_file(os.path.join(out, 'code', 'old.rpx'), b'v1')
+        record_state(out, os.path.join(cdn, 'title.tmd'))
+
+        create_cdn(cdn, [(0, 0, 10, 1), (1, 1, 11, 2), (2, 2, 10, 1)], 16)
+        assert apply_delta(cdn, out, make_decrypt(calls, b'v2'), Progress())['changed'] == [1]
+        assert calls[1:] == [['00000000.app', '00000001.app', '00000002.app', 'title.tik', 'title.tmd']]
+        with open(os.path.join(out, 'content', 'a.bin'), 'rb') as f:
+            assert f.read() == b'v2'
+        assert not os.path.exists(os.path.join(out, 'code', 'old.rpx'))
+
+def test_other_title_in_output_needs_full_decryption():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cdn = os.path.join(tmpdir, 'cdn')
+        out = os.path.join(tmpdir, 'out')
+        create_cdn(cdn, [(0, 0, 10, 1)], 0)
+        os.makedirs(out)
+        state = record_state(out, os.path.join(cdn, 'title.tmd'))
+        state['title_id'] = '0005000E1010F300'
+        write_state(out, state)
+
+        calls = []
+        assert apply_delta(cdn, out, make_decrypt(calls, b'v2'), Progress()) is None
+        assert calls == []
+
+def test_failed_decryption_records_no_state():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cdn = os.path.join(tmpdir, 'cdn')
+        out = os.path.join(tmpdir, 'out')
+        create_cdn(cdn, [(0, 0, 10, 1)], 0)
+        missing = os.path.join(tmpdir, 'no_decryptor.exe')
+
+        for _ in range(2):
+            sink = ListSink()
+            assert decrypt_cdn_folder(cdn, out, Progress(sink), decryptor=missing) is False
+            assert ERROR in sink.kinds()
+            assert load_state(out) is None
+
+# Fake decryptor that, like CDecrypt, aborts when a content listed in the TMD
+# is missing, and otherwise writes the "path:data" lines of every content
+STRICT_DECRYPTOR = """
+import os, sys, struct
+folder = sys.argv[1]
+with open(sys.argv[2], 'rb') as f:
+    tmd = f.read()
+count = struct.unpack_from('>H', tmd, 0x1DE)[0]
+for n in range(count):
+    content_id = struct.unpack_from('>I', tmd, 0xB04 + 0x30 * n)[0]
+    path = os.path.join(folder, f'{content_id:08x}.app')
+    if not os.path.exists(path):
+        sys.exit(f'missing content {content_id:08x}')
+    with open(path) as f:
+        for line in f.read().split():
+            rel, data = line.split(':')
+            os.makedirs(os.path.dirname(os.path.join(folder, rel)), exist_ok=True)
+            with open(os.path.join(folder, rel), 'w') as out:
+                out.write(data)
+"""
+
+@pytest.mark.skipif(os.name != 'posix', reason='needs an executable script')
+def test_failed_delta_falls_back_to_a_clean_full_decryption(monkeypatch):
+    # Pretend the decryptor handles partial folders so the delta is tried
+    monkeypatch.setattr(pipeline, 'DECRYPTOR_PARTIAL', True)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        decryptor = os.path.join(tmpdir, 'strict_cdecrypt')
+        with open(decryptor, 'w') as f:
+            f.write(f'#!{sys.executable}\n' + STRICT_DECRYPTOR)
+        os.chmod(decryptor, os.stat(decryptor).st_mode | stat.S_IEXEC)
+
+        cdn = os.path.join(tmpdir, 'cdn')
+        out = os.path.join(tmpdir, 'out')
+        create_tmd(os.path.join(cdn, 'title.tmd'), [(0, 0, 10, 1), (1, 1, 10, 1), (2, 2, 10, 1)], 0)
+        create_file(os.path.join(cdn, 'title.tik'), b'tik')
+        create_file(os.path.join(cdn, '00000000.app'), b'')
+        create_file(os.path.join(cdn, '00000002.app'), b'content/a.bin:a')
+        create_file(os.path.join(cdn, '00000001.app'), b'code/app.rpx:v1 code/old.rpx:v1')
+        assert decrypt_cdn_folder(cdn, out, Progress(), decryptor=decryptor)
+        assert load_state(out)['version'] == 0
+
+        # v2 only changes content 1: the partial folder makes the decryptor abort
+        create_tmd(os.path.join(cdn, 'title.tmd'), [(0, 0, 10, 1), (1, 1, 11, 2), (2, 2, 10, 1)], 16)
+        create_file(os.path.join(cdn, '00000001.app'), b'code/app.rpx:v2')
+        assert decrypt_cdn_folder(cdn, out, Progress(), decryptor=decryptor)
+
+        with open(os.path.join(out, 'code', 'app.rpx')) as f:
+            assert f.read() == 'v2'
+        assert not os.path.exists(os.path.join(out, 'code', 'code'))
+        assert not os.path.exists(os.path.join(out, 'code', 'old.rpx'))
+        state = load_state(out)
+        assert state['version'] == 16 and sorted(state['files']) == ['code/app.rpx', 'content/a.bin']
@@ -0,0 +1,88 @@
+import os
+import struct
+import tempfile
+import pytest
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from wiiman.fst_parser import FST, read_fst
+
+def build_fst(tree, offset_factor=0x20, clusters=2):
+    """
+    Builds raw FST bytes from a nested dict: name → dict (directory)
+    or name → (content, offset, size) / (content, offset, size, type) (file).
+    """
+    entries = []
+    names = bytearray(b'\x00')
+
+    def add_name(name):
+        offset = len(names)
+        names.extend(name.encode() + b'\x00')
+        return offset
+
+    def walk(node, parent):
+        for name, value in node.items():
+            index = len(entries)
+            if isinstance(value, dict):
+                entries.append([0x01, add_name(name), parent, 0, 0, 0])
+                walk(value, index)
+                entries[index][3] = len(entries)
+            else:
+                content, offset, size = value[:3]
+                kind = value[3] if len(value) > 3 else 0x00
+                entries.append([kind, add_name(name), offset // offset_factor, size, 0, content])
+
+    entries.append([0x01, 0, 0, 0, 0, 0])
+    walk(tree, 0)
+    entries[0][3] = len(entries)
+
+    raw = bytearray(b'FST\x00' + struct.pack('>II', offset_factor, clusters))
+    raw.extend(bytes(0x20 - len(raw)))
+    raw.extend(bytes(0x20 * clusters))
+    for kind, name_off, offset, size, flags, content in entries:
+        raw.extend(struct.pack('>IIIHH', (kind << 24) | name_off, offset, size, flags, content))
+    raw.extend(names)
+    return bytes(raw)
+
+TREE = {
+    'code': {'app.rpx': (1, 0x40, 100), 'cos.xml': (1, 0x80, 10)},
+    'content': {
+        'Common': {'a.bin': (2, 0x0, 5), 'gone.bin': (2, 0x20, 7, 0x80)},
+        'b.bin': (2, 0x100, 8),
+    },
+    'meta': {},
+    'root.txt': (1, 0x0, 3),
+}
+
+def test_parse_paths_and_fields():
+    fst = FST(build_fst(TREE))
+    paths = [path for _, path in fst.iter_paths()]
+    assert paths == ['code/app.rpx', 'code/cos.xml', 'content/Common/a.bin', 'content/b.bin', 'root.txt']
+    assert [fst.path(i) for i in fst.files()] == paths
+
+    index = fst.lookup('/content/b.bin')
+    assert fst.sizes[index] == 8
+    assert fst.contents[index] == 2
+    assert fst.file_offset(index) == 0x100
+    assert fst.lookup('content/Common/gone.bin') is not None
+    assert fst.lookup('missing') is None
+
+def test_parents_and_entries():
+    fst = FST(build_fst(TREE))
+    index = fst.lookup('content/Common/a.bin')
+    common = fst.parents[index]
+    assert fst.is_dir(common)
+    assert fst.path(common) == 'content/Common'
+    assert fst.path(fst.parents[common]) == 'content'
+    assert dict(fst.entries())['code/app.rpx'] == 100
+
+def test_read_fst_from_file_and_errors():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'fst.bin')
+        with open(path, 'wb') as f:
+            f.write(build_fst(TREE))
+        assert len(read_fst(path)) == 11
+
+    with pytest.raises(ValueError):
+        FST(b'NOPE' + bytes(0x40))
+    with pytest.raises(ValueError):
+        FST(build_fst(TREE)[:0x80])
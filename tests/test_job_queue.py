@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import tempfile
+import multiprocessing
+import pytest
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from wiiman.progress import Progress
+from wiiman import job_queue
+from wiiman.job_queue import (
+    enqueue, enqueue_folders, claim, reclaim_expired, run_worker, queue_status, init_queue,
+    PENDING, CLAIMED, DONE, FAILED
+)
+
+def fake_handler(job, staging, progress):
+    name = os.path.basename(job['layers'][0]['folder'])
+    if name == 'broken':
+        raise ValueError('bad key')
+    with open(os.path.join(staging, 'out.txt'), 'w') as f:
+        f.write(f"{job['worker']}\n")
+    # Record every run so double processing is caught
+    with open(os.path.join(job['output_root'], 'runs.log'), 'a') as f:
+        f.write(name + '\n')
+    time.sleep(0.01)
+    return name.upper()
+
+def worker_process(queue_dir, worker_id):
+    run_worker(queue_dir, handler=fake_handler, worker_id=worker_id, lease_ttl=30,
+               poll_interval=0.01, progress=Progress())
+
+def make_folders(tmpdir, names):
+    folders = []
+    for name in names:
+        folder = os.path.join(tmpdir, 'cdn', name)
+        os.makedirs(folder)
+        folders.append(folder)
+    return folders
+
+def layers_of(folder, title_id='000500001010F300'):
+    return [{'type': 'base', 'title_id': title_id, 'folder': folder}]
+
+def write_tmd(folder, title_id):
+    tmd = bytearray(0xB04)
+    tmd[0x18C:0x18C + 8] = bytes.fromhex(title_id)
+    with open(os.path.join(folder, 'title.tmd'), 'wb') as f:
+        f.write(tmd)
+
+def test_enqueue_is_idempotent():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = os.path.join(tmpdir, 'queue')
+        folder, = make_folders(tmpdir, ['game'])
+        assert enqueue(queue, layers_of(folder), tmpdir)
+        assert enqueue(queue, layers_of(folder), tmpdir) is None
+        assert queue_status(queue)[PENDING] == 1
+
+def test_expired_lease_is_reclaimed():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = os.path.join(tmpdir, 'queue')
+        folder, = make_folders(tmpdir, ['game'])
+        enqueue(queue, layers_of(folder), tmpdir)
+
+        job, claimed_path = claim(queue, 'dead-worker')
+        assert claim(queue, 'other') is None
+        assert reclaim_expired(queue, lease_ttl=30) == 0
+
+        old = time.time() - 60
+        os.utime(claimed_path, (old, old))
+        assert reclaim_expired(queue, lease_ttl=30) == 1
+        job, _ = claim(queue, 'other')
+        assert job['attempts'] == 2
+
+def test_failed_publish_fails_the_job(monkeypatch):
+    def publish_output(staging_dir, final_dir, tag=None):
+        raise PermissionError(f'cannot rename {staging_dir}')
+    monkeypatch.setattr(job_queue, 'publish_output', publish_output)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = os.path.join(tmpdir, 'queue')
+        folder, = make_folders(tmpdir, ['game'])
+        enqueue(queue, layers_of(folder), tmpdir)
+
+        assert run_worker(queue, handler=fake_handler, worker_id='w1', progress=Progress()) == 0
+        status = queue_status(queue)
+        assert status[FAILED] == 1 and status[CLAIMED] == 0
+        assert not [name for name in os.listdir(tmpdir) if name.startswith('.part-')]
+
+def test_family_layers_are_queued_as_one_job():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = os.path.join(tmpdir, 'queue')
+        base, update, dlc, other = make_folders(tmpdir, ['base', 'update', 'dlc', 'other'])
+        write_tmd(base, '0005000010101A00')
+        write_tmd(update, '0005000E10101A00')
+        write_tmd(dlc, '0005000C10101A00')
+        write_tmd(other, '000500001010F300')
+
+        jobs = enqueue_folders(queue, [dlc, update, base, other], tmpdir)
+        assert sorted(jobs) == ['10101A00', '1010F300'] and all(jobs.values())
+        assert queue_status(queue)[PENDING] == 2
+
+        job, _ = claim(queue, 'w')
+        while job['family'] != '10101A00':
+            job, _ = claim(queue, 'w')
+        assert [l['type'] for l in job['layers']] == ['base', 'update', 'dlc']
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_several_processes_share_the_queue():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = os.path.join(tmpdir, 'queue')
+        output = os.path.join(tmpdir, 'output')
+        os.makedirs(output)
+        names = [f'game{i}' for i in range(12)] + ['broken']
+        for folder in make_folders(tmpdir, names):
+            enqueue(queue, layers_of(folder), output)
+
+        ctx = multiprocessing.get_context('fork')
+        procs = [ctx.Process(target=worker_process, args=(queue, f'w{i}')) for i in range(4)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join(30)
+            assert proc.exitcode == 0
+
+        assert queue_status(queue) == {PENDING: 0, CLAIMED: 0, DONE: 12, 'failed': 1}
+        with open(os.path.join(output, 'runs.log')) as f:
+            runs = f.read().split()
+        assert sorted(runs) == sorted(names[:-1])
+
+        for name in names[:-1]:
+            assert os.path.exists(os.path.join(output, name.upper(), 'out.txt'))
+        assert not [n for n in os.listdir(output) if n.startswith('.part-')]
+
+        with open(os.path.join(queue, 'failed', os.listdir(os.path.join(queue, 'failed'))[0])) as f:
+            assert json.load(f)['error'] == 'bad key'
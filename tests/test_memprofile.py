@@ -0,0 +1,135 @@
+import os
+import json
+import stat
+import tempfile
+import subprocess
+import pytest
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from wiiman import memprofile
+from wiiman.memprofile import MemoryProfiler, MemoryBudgetExceeded
+from wiiman.decrypt_utils import run_cdecrypt
+from wiiman.progress import Progress, ListSink, ERROR
+
+MB = 1024 * 1024
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Size of the synthetic title decrypted in the flat-memory test
+SYNTHETIC_SIZE = 2048 * MB
+
+# Runs in a fresh interpreter so the process peak RSS starts low: decrypts
+# the synthetic title, then copies it out through the writer like a merge
+# across filesystems, and prints the memory report
+FLAT_MEMORY_SCRIPT = """
+import os, sys, json
+sys.path.insert(0, sys.argv[1])
+from wiiman.memprofile import MemoryProfiler
+from wiiman.decrypt_utils import run_cdecrypt
+from wiiman.output_writer import OutputWriter
+from wiiman.progress import Progress
+
+decryptor, folder, out, merged = sys.argv[2:6]
+profiler = MemoryProfiler(top=0)
+with profiler.stage('decrypt'):
+    assert run_cdecrypt(decryptor, folder, out, Progress())
+    with OutputWriter(merged, durable=False) as writer:
+        writer.copy_file('content/big.bin', os.path.join(out, 'content', 'big.bin'))
+print(json.dumps(profiler.report()))
+"""
+
+def test_stages_record_peaks_and_sites():
+    profiler = MemoryProfiler()
+    with profiler.stage('outer'):
+        with profiler.stage('inner'):
+            blob = bytearray(4 * MB)
+        del blob
+    peaks = {s['stage']: s['peak'] for s in profiler.stages}
+    assert peaks['inner'] >= 4 * MB
+    assert peaks['outer'] >= peaks['inner']
+    assert profiler.stages[0]['top']
+
+    profiler.assert_budget('inner', 8 * MB)
+    with pytest.raises(MemoryBudgetExceeded):
+        profiler.check_budgets({'outer': 1 * MB})
+    assert 'inner' in profiler.format_report()
+
+    profiler.stages = [{'stage': 'decrypt', 'rss_growth': 5 * MB, 'children_rss_peak': 40 * MB}]
+    profiler.assert_rss_budget('decrypt', 8 * MB, children_bytes=64 * MB)
+    for budget in ((4 * MB, None), (8 * MB, 32 * MB)):
+        with pytest.raises(MemoryBudgetExceeded):
+            profiler.assert_rss_budget('decrypt', *budget)
+
+def test_module_stage_is_noop_when_disabled():
+    memprofile.disable()
+    with memprofile.stage('anything'):
+        pass
+    profiler = memprofile.enable()
+    with memprofile.stage('rename'):
+        pass
+    memprofile.disable()
+    assert [s['stage'] for s in profiler.stages] == ['rename']
+
+@pytest.mark.skipif(os.name != 'posix', reason='needs an executable script')
+def test_decryptor_output_is_streamed():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        folder = os.path.join(tmpdir, 'cdn')
+        os.makedirs(folder)
+        for name in ('title.tik', 'title.tmd'):
+            open(os.path.join(folder, name), 'wb').close()
+
+        # Fake decryptor printing a line per file, like the real one
+        decryptor = os.path.join(tmpdir, 'fake_cdecrypt')
+        with open(decryptor, 'w') as f:
+            f.write(f'#!{sys.executable}\n'
+                    'import os, sys\n'
+                    'for i in range(200000):\n'
+                    '    print(f"Extracting content/file_{i:06d}.bin (0x{i:08x} bytes)")\n'
+                    'os.makedirs(os.path.join(sys.argv[1], "code"))\n')
+        os.chmod(decryptor, os.stat(decryptor).st_mode | stat.S_IEXEC)
+
+        out = os.path.join(tmpdir, 'out')
+        os.makedirs(out)
+        sink = ListSink()
+        profiler = MemoryProfiler(top=0)
+        with profiler.stage('decrypt'):
+            run_cdecrypt(decryptor, folder, out, Progress(sink))
+
+        assert os.path.isdir(os.path.join(out, 'code'))
+        assert ERROR not in sink.kinds()
+        # ~10 MB of output must not be held in memory
+        profiler.assert_budget('decrypt', 1 * MB)
+
+@pytest.mark.skipif(os.name != 'posix', reason='needs an executable script')
+def test_memory_is_flat_for_large_titles():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        folder = os.path.join(tmpdir, 'cdn')
+        os.makedirs(folder)
+        for name in ('title.tik', 'title.tmd'):
+            open(os.path.join(folder, name), 'wb').close()
+
+        # Fake decryptor producing a sparse 2 GB content file
+        decryptor = os.path.join(tmpdir, 'fake_cdecrypt')
+        with open(decryptor, 'w') as f:
+            f.write(f'#!{sys.executable}\n'
+                    'import os, sys\n'
+                    'os.makedirs(os.path.join(sys.argv[1], "content"))\n'
+                    'with open(os.path.join(sys.argv[1], "content", "big.bin"), "wb") as f:\n'
+                    f'    f.truncate({SYNTHETIC_SIZE})\n')
+        os.chmod(decryptor, os.stat(decryptor).st_mode | stat.S_IEXEC)
+
+        out = os.path.join(tmpdir, 'out')
+        merged = os.path.join(tmpdir, 'merged')
+        os.makedirs(out)
+        result = subprocess.run(
+            [sys.executable, '-c', FLAT_MEMORY_SCRIPT, ROOT, decryptor, folder, out, merged],
+            capture_output=True, text=True
+        )
+        assert result.returncode == 0, result.stderr
+        assert os.path.getsize(os.path.join(merged, 'content', 'big.bin')) == SYNTHETIC_SIZE
+
+        profiler = MemoryProfiler()
+        profiler.stages = json.loads(result.stdout.splitlines()[-1])['stages']
+        profiler.assert_budget('decrypt', 1 * MB)
+        # Native memory too: the 4 MiB copy buffer, not the 2 GB title
+        profiler.assert_rss_budget('decrypt', 32 * MB, children_bytes=64 * MB)
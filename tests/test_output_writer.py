@@ -0,0 +1,33 @@
+import os
+import tempfile
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from wiiman.output_writer import OutputWriter, BUFFER_SIZE
+
+def test_plan_creates_directory_set():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = os.path.join(tmpdir, 'out')
+        entries = [('content/a/b/c.bin', 1), ('content/a/d.bin', 2), ('code/app.rpx', 3), ('root.bin', 4)]
+        writer = OutputWriter(root)
+        writer.plan(entries)
+        for rel in ('content', 'content/a', 'content/a/b', 'code'):
+            assert os.path.isdir(os.path.join(root, rel))
+        writer.finish()
+
+def test_write_and_copy_files():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'big.bin')
+        data = os.urandom(BUFFER_SIZE * 2 + 123)
+        with open(src, 'wb') as f:
+            f.write(data)
+
+        root = os.path.join(tmpdir, 'out')
+        with OutputWriter(root) as writer:
+            writer.write_bytes('meta/meta.xml', b'<xml/>')
+            assert writer.copy_file('content/big.bin', src) == len(data)
+            writer.copy_file('content/small.bin', os.path.join(root, 'meta', 'meta.xml'))
+
+        with open(os.path.join(root, 'content', 'big.bin'), 'rb') as f:
+            assert f.read() == data
+        with open(os.path.join(root, 'content', 'small.bin'), 'rb') as f:
+            assert f.read() == b'<xml/>'
@@ -0,0 +1,150 @@
+import os
+import struct
+import tempfile
+import pytest
+from collections import namedtuple
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from wiiman import preflight
+from wiiman.preflight import plan_library, format_plan
+from wiiman.throughput import record_throughput, load_history, estimate_seconds
+from wiiman.delta import record_state
+from wiiman.pipeline import process_job
+from wiiman.progress import Progress
+
+CSV = (
+    'TITLE ID,TITLE KEY,NAME,REGION,TYPE\n'
+    '0005000010101A00,40c6204eff2709fb7a614294b4aebaaa,LEGO CITY: Undercover,EUR,Base\n'
+    '0005000E10101A00,fa37b75fd0de03d2a297471477066c7c,LEGO CITY Update,EUR,Update\n'
+    '000500001010F300,,Family Party,USA,Base\n'
+)
+
+def create_file(path, content=b''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+def create_tmd(path, title_id, contents, version=0):
+    """contents: list of (content_id, index, size)"""
+    tmd = bytearray(0xB04 + 0x30 * len(contents))
+    tmd[0x18C:0x18C + 8] = bytes.fromhex(title_id)
+    struct.pack_into('>HH', tmd, 0x1DC, version, len(contents))
+    for n, (content_id, index, size) in enumerate(contents):
+        struct.pack_into('>IHHQ', tmd, 0xB04 + 0x30 * n, content_id, index, 0x2003, size)
+    create_file(path, bytes(tmd))
+
+def create_cdn(folder, title_id, contents, tmd_name='title.tmd'):
+    create_tmd(os.path.join(folder, tmd_name), title_id, contents)
+    for content_id, _index, _size in contents:
+        create_file(os.path.join(folder, f'{content_id:08x}'), b'x')
+
+def setup_library(tmpdir):
+    library = os.path.join(tmpdir, 'library')
+    create_cdn(os.path.join(library, 'lego'), '0005000010101A00', [(0, 0, 0x8000), (1, 1, 3 << 20)])
+    create_cdn(os.path.join(library, 'lego_update'), '0005000E10101A00', [(0, 0, 0x8000), (5, 1, 1 << 20)],
+               tmd_name='tmd.16')
+    create_cdn(os.path.join(library, 'party'), '000500001010F300', [(0, 0, 0x8000)])
+    csv_path = os.path.join(tmpdir, 'keys.csv')
+    with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(CSV)
+    return library, csv_path
+
+def snapshot(folder):
+    return sorted(
+        (os.path.relpath(os.path.join(d, f), folder), os.path.getmtime(os.path.join(d, f)))
+        for d, _dirs, files in os.walk(folder) for f in files
+    )
+
+def test_library_plan_uses_metadata_only():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        library, csv_path = setup_library(tmpdir)
+        before = snapshot(library)
+        plans = {os.path.basename(p['folder']): p for p in plan_library(library, csv_path=csv_path, history=[])}
+        assert snapshot(library) == before
+
+        lego, update, party = plans['lego'], plans['lego_update'], plans['party']
+        assert lego['problems'] == [] and update['problems'] == []
+        assert lego['output_dir'] == update['output_dir'] == os.path.join(library, 'LEGO CITY Undercover')
+        assert lego['write_bytes'] == 0x8000 + (3 << 20)
+        assert 'rename 2 extensionless content file(s) to .app' in lego['actions']
+        assert 'promote tmd.16 to title.tmd' in update['actions']
+        assert lego['estimated_seconds'] is None
+
+        assert party['problems'] == ['key database entry rejected (bad Title Key)']
+        assert '3 title(s), 1 blocked' in format_plan(plans.values())
+
+def test_missing_content_blocks_the_whole_family():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        library, csv_path = setup_library(tmpdir)
+        os.remove(os.path.join(library, 'lego_update', '00000005'))
+        plans = {os.path.basename(p['folder']): p for p in plan_library(library, csv_path=csv_path, history=[])}
+        assert plans['lego_update']['problems'] == ['1 content(s) missing: 00000005']
+        assert plans['lego']['problems'] == ['another layer of this title family is blocked']
+
+def test_truncated_tmd_only_blocks_its_title():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        library, csv_path = setup_library(tmpdir)
+        create_file(os.path.join(library, 'party', 'title.tmd'), bytes(0x190))
+        plans = {os.path.basename(p['folder']): p for p in plan_library(library, csv_path=csv_path, history=[])}
+        assert plans['party']['problems'][0].startswith('unreadable TMD title.tmd: TMD is truncated')
+        assert plans['lego']['problems'] == []
+
+def test_single_folder_plans_a_delta_against_recorded_state(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        library, csv_path = setup_library(tmpdir)
+        folder = os.path.join(library, 'lego')
+        output_dir = os.path.join(library, 'LEGO CITY Undercover')
+        os.makedirs(output_dir)
+        record_state(output_dir, os.path.join(folder, 'title.tmd'))
+
+        create_tmd(os.path.join(folder, 'title.tmd'), '0005000010101A00',
+                   [(0, 0, 0x8000), (1, 1, 3 << 20), (2, 2, 1 << 20)], version=16)
+        create_file(os.path.join(folder, '00000002'), b'x')
+        history = [{'stage': 'decrypt', 'bytes': 1 << 20, 'seconds': 2.0}]
+
+        [plan] = plan_library(folder, csv_path=csv_path, history=history)
+        assert plan['problems'] == []
+        # CDecrypt needs the complete folder, so a changed title is decrypted in full
+        assert 'decrypt all 3 content(s) into the existing output, drop files no longer listed' in plan['actions']
+        assert plan['write_bytes'] == 0x8000 + (4 << 20)
+        assert plan['estimated_seconds'] == 8.0625
+
+        monkeypatch.setattr(preflight, 'DECRYPTOR_PARTIAL', True)
+        [plan] = plan_library(folder, csv_path=csv_path, history=history)
+        assert 'delta decrypt 1 content(s)' in plan['actions']
+        assert plan['write_bytes'] == 1 << 20
+        assert plan['estimated_seconds'] == 2.0
+
+def test_not_enough_space_is_blocking(monkeypatch):
+    usage = namedtuple('usage', 'total used free')
+    monkeypatch.setattr(preflight.shutil, 'disk_usage', lambda path: usage(1 << 30, 1 << 30, 1 << 20))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        library, csv_path = setup_library(tmpdir)
+        plans = plan_library(library, os.path.join(tmpdir, 'out', 'games'), csv_path=csv_path, history=[])
+        lego = next(p for p in plans if p['folder'].endswith('lego'))
+        assert lego['output_dir'].startswith(os.path.join(tmpdir, 'out', 'games'))
+        assert lego['problems'][0].startswith(f'not enough space on {tmpdir}')
+
+def test_queue_job_fails_before_touching_the_folder():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        folder = os.path.join(tmpdir, 'cdn', 'unknown')
+        create_cdn(folder, '00050000DEADBE00', [(0, 0, 0x8000)])
+        staging = os.path.join(tmpdir, 'staging')
+        os.makedirs(staging)
+        before = snapshot(folder)
+
+        job = {'layers': [{'type': 'base', 'title_id': '00050000DEADBE00', 'folder': folder}]}
+        with pytest.raises(ValueError, match='Preflight failed: unknown: Title ID not in the key database'):
+            process_job(job, staging, Progress())
+        assert snapshot(folder) == before
+
+def test_throughput_history():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'history.json')
+        record_throughput('decrypt', 100, 0.1, path)  # Too short to be meaningful
+        record_throughput('decrypt', 300, 2.0, path)
+        record_throughput('decrypt', 500, 2.0, path)
+        history = load_history(path)
+        assert len(history) == 2
+        assert estimate_seconds(history, 'decrypt', 400) == 2.0
+        assert estimate_seconds(history, 'merge', 400) is None
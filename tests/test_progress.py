@@ -0,0 +1,125 @@
+import io
+import os
+import stat
+import struct
+import json
+import time
+import queue
+import tempfile
+import threading
+import pytest
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from wiiman.progress import (
+    Progress, ListSink, JsonLinesSink, QueueSink, AggregateSink, drain_queue,
+    STAGE_START, STAGE_END, BYTES, INFO, ERROR
+)
+from wiiman.decrypt_utils import generate_fake_tik, run_cdecrypt
+
+def test_stage_events_and_coalesced_bytes():
+    sink = ListSink()
+    progress = Progress(sink, interval=60)
+    with progress.stage('decrypt', total=1000):
+        for _ in range(100):
+            progress.advance(10)
+
+    # First chunk is emitted right away, the rest is held back until the flush
+    assert sink.kinds() == [STAGE_START, BYTES, BYTES, STAGE_END]
+    assert sink.events[1].done == 10
+    assert sink.events[2].done == 1000
+    assert sink.events[3].stage == 'decrypt' and sink.events[3].message == ''
+
+def test_failed_stage_is_reported():
+    sink = ListSink()
+    progress = Progress(sink)
+    try:
+        with progress.stage('merge'):
+            raise OSError('disk full')
+    except OSError:
+        pass
+    assert sink.events[-1].kind == STAGE_END
+    assert 'disk full' in sink.events[-1].message
+
+def test_advance_is_thread_safe():
+    sink = ListSink()
+    progress = Progress(sink, interval=0)
+    progress.start_stage('copy')
+
+    def work():
+        for _ in range(1000):
+            progress.advance(1)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    progress.end_stage()
+    assert sink.events[-1].done == 4000
+
+def test_queue_aggregation_and_json_lines():
+    events = queue.Queue()
+    for source in ('w1', 'w2'):
+        producer = Progress(QueueSink(events), source=source)
+        with producer.stage('decrypt', total=100):
+            producer.advance(40)
+
+    aggregate = AggregateSink()
+    stream = io.StringIO()
+    assert drain_queue(events, aggregate, JsonLinesSink(stream)) == 6
+    assert aggregate.totals() == (80, 200)
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert {line['source'] for line in lines} == {'w1', 'w2'}
+
+def test_generate_fake_tik_reports_events():
+    sink = ListSink()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        generate_fake_tik('000500001010F300', '00' * 16, tmpdir, Progress(sink))
+        generate_fake_tik('XYZ', '00' * 16, tmpdir, Progress(sink))
+    assert sink.kinds() == [INFO, ERROR]
+
+# Fake decryptor printing CDecrypt's per-file lines
+FAKE_DECRYPTOR = """
+import os, sys
+folder = sys.argv[1]
+print('CDecrypt v2.0b')
+for rel, size in (('code/app.rpx', 0x400), ('content/a.bin', 0x800)):
+    os.makedirs(os.path.join(folder, os.path.dirname(rel)), exist_ok=True)
+    with open(os.path.join(folder, rel), 'wb') as f:
+        f.write(bytes(size))
+    print(f'Size:{size:07X} Offset:0x{0:010X} CID:01 U:01 {rel}')
+"""
+
+@pytest.mark.skipif(os.name != 'posix', reason='needs an executable script')
+def test_decrypt_stage_reports_bytes():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        decryptor = os.path.join(tmpdir, 'cdecrypt')
+        with open(decryptor, 'w') as f:
+            f.write(f'#!{sys.executable}\n' + FAKE_DECRYPTOR)
+        os.chmod(decryptor, os.stat(decryptor).st_mode | stat.S_IEXEC)
+
+        cdn = os.path.join(tmpdir, 'cdn')
+        os.makedirs(cdn)
+        tmd = bytearray(0xB04 + 0x30 * 2)
+        struct.pack_into('>H', tmd, 0x1DE, 2)
+        struct.pack_into('>IHHQ', tmd, 0xB04, 0, 0, 0x2001, 0x8000)
+        struct.pack_into('>IHHQ', tmd, 0xB34, 1, 1, 0x2003, 0x10000)
+        with open(os.path.join(cdn, 'title.tmd'), 'wb') as f:
+            f.write(tmd)
+        with open(os.path.join(cdn, 'title.tik'), 'wb') as f:
+            f.write(b'tik')
+
+        sink, aggregate = ListSink(), AggregateSink()
+        assert run_cdecrypt(decryptor, cdn, os.path.join(tmpdir, 'out'), Progress(sink, aggregate, interval=0))
+
+        assert BYTES in sink.kinds()
+        assert aggregate.totals() == (0xC00, 0x18000)
+
+def test_advance_overhead_is_small():
+    progress = Progress(ListSink())
+    progress.start_stage('bench')
+    start = time.perf_counter()
+    for _ in range(100000):
+        progress.advance(4096)
+    assert time.perf_counter() - start < 1.0
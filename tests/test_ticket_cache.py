@@ -0,0 +1,94 @@
+import os
+import tempfile
+import pytest
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from wiiman.decrypt_utils import build_ticket, generate_fake_tik
+from wiiman.ticket_cache import build_ticket_cache, ensure_ticket_cache, TicketCache
+from wiiman import pipeline
+from wiiman.pipeline import write_title_ticket, open_ticket_cache
+from wiiman.progress import Progress
+
+CSV = (
+    '﻿TITLE ID,TITLE KEY,NAME,REGION,TYPE\n'
+    '000500001010f300,fa37b75fd0de03d2a297471477066c7c,"Family Party\n  30 Great Games",USA,Base\n'
+    '0005000010101A00,40c6204eff2709fb7a614294b4aebaaa,LEGO CITY,EUR,Base\n'
+    '0005000e10101a00,,LEGO CITY Update,EUR,Update\n'
+    '00050000zz101a00,40c6204eff2709fb7a614294b4aebaaa,Broken,EUR,Base\n'
+    '0005000010101a00,00000000000000000000000000000000,LEGO CITY again,EUR,Base\n'
+)
+
+def write_csv(tmpdir):
+    path = os.path.join(tmpdir, 'keys.csv')
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(CSV)
+    return path
+
+def test_cache_matches_single_ticket_builder():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_path = os.path.join(tmpdir, 'keys.tikcache')
+        invalid = build_ticket_cache(write_csv(tmpdir), cache_path)
+
+        assert [(e['row'], e['reason']) for e in invalid] == [
+            (4, 'bad Title Key'), (5, 'bad Title ID'), (6, 'conflicting duplicate Title Key')
+        ]
+
+        with TicketCache(cache_path) as cache:
+            assert len(cache) == 2
+            assert '0005000010101a00' in cache
+            assert '0005000E10101A00' not in cache
+            with cache.lookup('000500001010F300') as record:
+                expected = build_ticket(bytes.fromhex('000500001010f300'),
+                                        bytes.fromhex('fa37b75fd0de03d2a297471477066c7c'))
+                assert bytes(record) == bytes(expected)
+
+            assert cache.write_ticket('0005000010101A00', tmpdir)
+            generate_fake_tik('0005000010101A00', '40c6204eff2709fb7a614294b4aebaaa',
+                              tmpdir, Progress())
+            with open(os.path.join(tmpdir, 'title.tik'), 'rb') as f:
+                single = f.read()
+            os.remove(os.path.join(tmpdir, 'title.tik'))
+            cache.write_ticket('0005000010101A00', tmpdir)
+            with open(os.path.join(tmpdir, 'title.tik'), 'rb') as f:
+                assert f.read() == single
+
+def test_ensure_rebuilds_only_when_stale():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = write_csv(tmpdir)
+        cache_path = os.path.join(tmpdir, 'keys.tikcache')
+        assert ensure_ticket_cache(csv_path, cache_path) is not None
+        assert ensure_ticket_cache(csv_path, cache_path) is None
+        os.utime(csv_path, (os.path.getmtime(cache_path) + 10,) * 2)
+        assert ensure_ticket_cache(csv_path, cache_path) is not None
+
+def test_pipeline_rejects_invalid_key_up_front():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = write_csv(tmpdir)
+        matched = {'Title ID': '0005000E10101A00', 'Title Key': '', 'Name': 'LEGO CITY Update'}
+        with pytest.raises(ValueError):
+            write_title_ticket(tmpdir, matched, Progress(), csv_path)
+        assert not os.path.exists(os.path.join(tmpdir, 'title.tik'))
+
+        matched = {'Title ID': '000500001010F300', 'Title Key': 'fa37b75fd0de03d2a297471477066c7c', 'Name': 'x'}
+        write_title_ticket(tmpdir, matched, Progress(), csv_path)
+        assert os.path.getsize(os.path.join(tmpdir, 'title.tik')) == 0x2A4
+
+def test_open_cache_closes_map_before_rebuild(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = write_csv(tmpdir)
+        old = open_ticket_cache(csv_path)
+        assert [e['row'] for e in old.invalid] == [4, 5, 6]
+        assert open_ticket_cache(csv_path) is old
+
+        # Replacing a mapped file fails on Windows, the map must be gone first
+        real_build = pipeline.build_ticket_cache
+        def build(csv_path, cache_path):
+            assert old._map is None
+            return real_build(csv_path, cache_path)
+        monkeypatch.setattr(pipeline, 'build_ticket_cache', build)
+
+        os.utime(csv_path, (os.path.getmtime(pipeline.ticket_cache_path(csv_path)) + 10,) * 2)
+        new = open_ticket_cache(csv_path)
+        assert new is not old and len(new) == 2
+        assert [e['row'] for e in new.invalid] == [4, 5, 6]
+        pipeline._ticket_caches.pop(pipeline.ticket_cache_path(csv_path)).close()
@@ -0,0 +1,140 @@
+import os
+import json
+import tempfile
+import pytest
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from wiiman.title_group import group_cdn_folders, process_family, merge_layer, MANIFEST_NAME
+from wiiman.progress import Progress
+
+def create_file(path, content=b''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+def create_tmd(path, title_id):
+    tmd = bytearray(0x200)
+    tmd[0x18C:0x18C + 8] = bytes.fromhex(title_id)
+    create_file(path, bytes(tmd))
+
+def test_group_by_family_in_layer_order():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dlc = os.path.join(tmpdir, 'dlc')
+        update = os.path.join(tmpdir, 'update')
+        base = os.path.join(tmpdir, 'base')
+        other = os.path.join(tmpdir, 'other')
+        create_tmd(os.path.join(dlc, 'title.tmd'), '0005000C1010F300')
+        create_tmd(os.path.join(update, 'tmd.32'), '0005000E1010F300')
+        create_tmd(os.path.join(base, 'title.tmd'), '000500001010F300')
+        create_tmd(os.path.join(other, 'title.tmd'), '0005000010ABCD00')
+
+        families = group_cdn_folders([dlc, update, base, other])
+
+        assert set(families) == {'1010F300', '10ABCD00'}
+        layers = families['1010F300']
+        assert [layer['type'] for layer in layers] == ['base', 'update', 'dlc']
+        assert layers[1]['folder'] == update
+
+def test_process_family_overrides_and_records_layers():
+    files = {
+        '000500001010F300': {'code/app.rpx': b'base', 'content/a.bin': b'base-a'},
+        '0005000E1010F300': {'code/app.rpx': b'update'},
+        '0005000C1010F300': {'content/dlc.bin': b'dlc'},
+    }
+    layers = [
+        {'type': 'base', 'title_id': '000500001010F300', 'folder': None},
+        {'type': 'update', 'title_id': '0005000E1010F300', 'folder': None},
+        {'type': 'dlc', 'title_id': '0005000C1010F300', 'folder': None},
+    ]
+
+    def decrypt(layer, staging):
+        for rel, data in files[layer['title_id']].items():
+            create_file(os.path.join(staging, rel), data)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out = os.path.join(tmpdir, 'Game')
+        manifest = process_family(layers, out, decrypt, Progress())
+
+        with open(os.path.join(out, 'code', 'app.rpx'), 'rb') as f:
+            assert f.read() == b'update'
+        assert os.path.exists(os.path.join(out, 'aoc', 'content', 'dlc.bin'))
+        assert manifest['files']['code/app.rpx'] == '0005000E1010F300'
+        assert manifest['files']['content/a.bin'] == '000500001010F300'
+        assert manifest['files']['aoc/content/dlc.bin'] == '0005000C1010F300'
+        assert not [name for name in os.listdir(out) if name.startswith('.layer_')]
+
+        with open(os.path.join(out, MANIFEST_NAME)) as f:
+            assert json.load(f) == manifest
+
+def test_failed_layer_leaves_the_previous_output():
+    layers = [
+        {'type': 'base', 'title_id': '000500001010F300', 'folder': None},
+        {'type': 'update', 'title_id': '0005000E1010F300', 'folder': None},
+    ]
+    files = {
+        '000500001010F300': {'code/app.rpx': b'base', 'content/old.bin': b'base'},
+        '0005000E1010F300': {'code/app.rpx': b'update'},
+    }
+
+    def decrypt(layer, staging):
+        for rel, data in files[layer['title_id']].items():
+            create_file(os.path.join(staging, rel), data)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out = os.path.join(tmpdir, 'Game')
+        process_family(layers, out, decrypt, Progress())
+        with open(os.path.join(out, MANIFEST_NAME)) as f:
+            before = json.load(f)
+
+        # The update's decryption now fails without raising, like run_cdecrypt
+        del files['0005000E1010F300']['code/app.rpx']
+        with pytest.raises(RuntimeError, match='update 0005000E1010F300 produced no output'):
+            process_family(layers, out, decrypt, Progress())
+
+        with open(os.path.join(out, 'code', 'app.rpx'), 'rb') as f:
+            assert f.read() == b'update'
+        with open(os.path.join(out, MANIFEST_NAME)) as f:
+            assert json.load(f) == before
+        assert [layer['type'] for layer in before['layers']] == ['base', 'update']
+        assert os.listdir(tmpdir) == ['Game']
+
+def test_rerun_drops_files_of_the_previous_version():
+    layers = [{'type': 'base', 'title_id': '000500001010F300', 'folder': None}]
+    files = {'code/app.rpx': b'v1', 'content/old.bin': b'v1'}
+
+    def decrypt(layer, staging):
+        for rel, data in files.items():
+            create_file(os.path.join(staging, rel), data)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out = os.path.join(tmpdir, 'Game')
+        process_family(layers, out, decrypt, Progress())
+        files = {'code/app.rpx': b'v2'}
+        manifest = process_family(layers, out, decrypt, Progress())
+
+        assert not os.path.exists(os.path.join(out, 'content', 'old.bin'))
+        assert list(manifest['files']) == ['code/app.rpx']
+        assert manifest['layers'] == [{'type': 'base', 'title_id': '000500001010F300'}]
+
+def test_merge_by_rename_does_not_fsync(monkeypatch):
+    syncs = []
+    monkeypatch.setattr(os, 'fsync', syncs.append)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        layer = os.path.join(tmpdir, 'layer')
+        for i in range(50):
+            create_file(os.path.join(layer, 'content', f'dir{i}', 'file.bin'), b'x')
+        assert merge_layer(layer, os.path.join(tmpdir, 'merged'), 'X', {'files': {}}) == 50
+    assert syncs == []
+
+def test_merge_layer_hardlinks_keep_source():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        layer = os.path.join(tmpdir, 'layer')
+        merged = os.path.join(tmpdir, 'merged')
+        src = os.path.join(layer, 'meta', 'meta.xml')
+        create_file(src, b'xml')
+        manifest = {'layers': [], 'files': {}}
+
+        assert merge_layer(layer, merged, 'X', manifest, link=True) == 1
+        dst = os.path.join(merged, 'meta', 'meta.xml')
+        assert os.path.exists(src)
+        assert os.stat(src).st_ino == os.stat(dst).st_ino
@@ -1,9 +1,41 @@
 # decrypt_utils.py
 import os
+import re
 import shutil
+import logging
 import subprocess
+from collections import deque
+from wiiman.tmd_parser import read_tmd_contents
 
-def generate_fake_tik(title_id, title_key, output_path, ui):
+# Lines of decryptor output kept for error reports
+OUTPUT_TAIL = 50
+
+# CDecrypt prints "Size:%07X Offset:... CID:.. U:.. <path>" per extracted file
+FILE_LINE = re.compile(r"Size:([0-9A-Fa-f]+)\s")
+
+# Folders the decryptor writes, moved to the output as a whole
+DECRYPTED_DIRS = ("code", "content", "meta")
+
+# CDecrypt aborts on the first content missing from the folder, and never
+# writes out the decrypted FST: it cannot decrypt only the changed contents
+DECRYPTOR_PARTIAL = False
+
+# 🎫 Minimal ticket layout
+TIK_SIZE = 0x2A4
+TIK_TITLE_KEY_OFFSET = 0x1BF
+TIK_TITLE_ID_OFFSET = 0x1DC
+
+def build_ticket(title_id_bytes, title_key_bytes):
+    """Returns a minimal ticket for an 8-byte Title ID and a 16-byte Title Key."""
+    if len(title_id_bytes) != 8 or len(title_key_bytes) != 16:
+        raise ValueError("Invalid Title ID or Key length.")
+
+    tik = bytearray(TIK_SIZE)
+    tik[TIK_TITLE_ID_OFFSET:TIK_TITLE_ID_OFFSET + 8] = title_id_bytes
+    tik[TIK_TITLE_KEY_OFFSET:TIK_TITLE_KEY_OFFSET + 16] = title_key_bytes
+    return tik
+
+def generate_fake_tik(title_id, title_key, output_path, progress):
     """
     Generates a minimal fake .tik using Title ID and Key.
 
@@ -11,39 +43,35 @@ def generate_fake_tik(title_id, title_key, output_path, ui):
         title_id (str): 16-char hex Title ID
         title_key (str): 32-char hex Title Key
         output_path (str): Folder to write 'title.tik'
-        ui: UI object for feedback (can be dummy if not using)
+        progress (Progress): Receives the progress events
     """
     try:
-        # 📦 Build binary structure
-        title_id_bytes = bytes.fromhex(title_id)
-        title_key_bytes = bytes.fromhex(title_key)
-
-        if len(title_id_bytes) != 8 or len(title_key_bytes) != 16:
-            raise ValueError("Invalid Title ID or Key length.")
-
         # ⚙️ Create minimal ticket
-        tik = bytearray(0x2A4)  # Base size of .tik
-        tik[0x01DC:0x01DC+8] = title_id_bytes      # Title ID
-        tik[0x01BF:0x01BF+16] = title_key_bytes    # Title Key
+        tik = build_ticket(bytes.fromhex(title_id), bytes.fromhex(title_key))
 
         # 💾 Write to file
         tik_path = os.path.join(output_path, "title.tik")
         with open(tik_path, "wb") as f:
             f.write(tik)
 
-        ui.update("✅ Generated title.tik")
+        progress.info("✅ Generated title.tik")
 
     except Exception as e:
-        ui.update(f"[ERROR] Failed to generate title.tik: {e}")
+        progress.error(f"Failed to generate title.tik: {e}")
 
 
-def copy_cert(cert_file, folder_path, ui):
+def copy_cert(cert_file, folder_path, progress):
     shutil.copy(cert_file, os.path.join(folder_path, "title.cert"))
-    ui.update("Copied title.cert")
+    progress.info("Copied title.cert")
 
-def run_cdecrypt(decryptor, folder_path, output_folder, ui):
-    import subprocess
+def run_cdecrypt(decryptor, folder_path, output_folder, progress):
+    """
+    Runs the decryptor on a CDN folder and moves the decrypted folders to output_folder.
 
+    Returns:
+        bool: True if the decryptor succeeded and produced decrypted folders.
+              Failures are reported through progress.
+    """
     try:
         if not os.path.exists(decryptor):
             raise FileNotFoundError("cddecrypt.exe not found")
@@ -54,28 +82,53 @@ def run_cdecrypt(decryptor, folder_path, output_folder, ui):
         if not os.path.exists(tik) or not os.path.exists(tmd):
             raise FileNotFoundError("Required .tik or .tmd file missing")
 
-        cmd = [decryptor, folder_path, tmd, tik]
-        ui.update("🔓 Running cddecrypt...")
-
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        # 📏 The contents' sizes are the total, hash trees make it slightly larger than the files
+        try:
+            total = sum(c["size"] for c in read_tmd_contents(tmd))
+        except (OSError, ValueError):
+            total = None
 
-        if result.returncode == 0:
-            ui.update("✅ Decryption complete")
+        cmd = [decryptor, folder_path, tmd, tik]
+        with progress.stage("decrypt", total=total):
+            progress.info("🔓 Running cddecrypt...")
+
+            # 📜 Stream the output instead of buffering it, it has a line per file
+            tail = deque(maxlen=OUTPUT_TAIL)
+            with subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                text=True, errors="replace"
+            ) as proc:
+                for line in proc.stdout:
+                    line = line.rstrip()
+                    if line:
+                        tail.append(line)
+                        logging.debug(line)
+                        match = FILE_LINE.match(line)
+                        if match:
+                            progress.advance(int(match.group(1), 16))
+            returncode = proc.returncode
+
+        if returncode == 0:
+            progress.info("✅ Decryption complete")
 
             # 📁 Only move decrypted folders
             moved_dirs = 0
-            for folder_name in ("code", "content", "meta"):
+            for folder_name in DECRYPTED_DIRS:
                 src = os.path.join(folder_path, folder_name)
                 dst = os.path.join(output_folder, folder_name)
                 if os.path.isdir(src):
                     shutil.move(src, dst)
                     moved_dirs += 1
 
-            ui.update(f"📦 Moved {moved_dirs} decrypted folder(s) to: {output_folder}")
+            if not moved_dirs:
+                progress.error("Decryption produced no files")
+                return False
+            progress.info(f"📦 Moved {moved_dirs} decrypted folder(s) to: {output_folder}")
+            return True
 
-        else:
-            ui.update("❌ Decryption failed")
-            logging.error(result.stderr)
+        progress.error("Decryption failed")
+        logging.error("\n".join(tail))
 
     except Exception as e:
-        ui.update(f"[ERROR] cddecrypt execution failed: {e}")
+        progress.error(f"cddecrypt execution failed: {e}")
+    return False
@@ -0,0 +1,293 @@
+import os
+import json
+import shutil
+from wiiman.tmd_parser import read_tmd_title_id, read_tmd_version, read_tmd_contents
+from wiiman.title_group import merge_layer
+from wiiman.decrypt_utils import DECRYPTED_DIRS
+
+# 📝 Recorded next to the decrypted output
+STATE_NAME = ".wiidcrypt_state.json"
+
+# Files the decryptor needs besides the contents themselves
+TITLE_FILES = ("title.tmd", "title.tik", "title.cert")
+
+
+def load_state(output_dir):
+    state_path = os.path.join(output_dir, STATE_NAME)
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_state(output_dir, state):
+    state_path = os.path.join(output_dir, STATE_NAME)
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+def _file_map(output_dir, fst=None):
+    """
+    Maps every output file to the content index it came from.
+    Without an FST the owning content is unknown and recorded as None.
+    """
+    if fst is not None:
+        return {path: fst.contents[i] for i, path in fst.iter_paths()}
+
+    files = {}
+    for dirpath, _dirnames, filenames in os.walk(output_dir):
+        for fname in filenames:
+            rel = os.path.relpath(os.path.join(dirpath, fname), output_dir).replace(os.sep, "/")
+            if rel != STATE_NAME:
+                files[rel] = None
+    return files
+
+
+def record_state(output_dir, tmd_path, fst=None):
+    """
+    Records the content records of tmd_path and the files of output_dir
+    so a later TMD version can be applied incrementally.
+    """
+    state = {
+        "title_id": read_tmd_title_id(tmd_path),
+        "version": read_tmd_version(tmd_path),
+        "contents": {str(c["index"]): c for c in read_tmd_contents(tmd_path)},
+        "files": _file_map(output_dir, fst),
+    }
+    write_state(output_dir, state)
+    return state
+
+
+def diff_contents(old_contents, new_contents):
+    """
+    Compares recorded content records with a new TMD's.
+
+    Args:
+        old_contents (dict): index (str) → record, as stored in the state
+        new_contents (list): Records from read_tmd_contents
+
+    Returns:
+        dict: Sorted content indexes under "added", "changed", "removed"
+              and "unchanged".
+    """
+    new_by_index = {str(c["index"]): c for c in new_contents}
+    diff = {"added": [], "changed": [], "removed": [], "unchanged": []}
+
+    for key, record in new_by_index.items():
+        old = old_contents.get(key)
+        if old is None:
+            diff["added"].append(record["index"])
+        elif (old["id"], old["size"], old["hash"]) != (record["id"], record["size"], record["hash"]):
+            diff["changed"].append(record["index"])
+        else:
+            diff["unchanged"].append(record["index"])
+
+    diff["removed"] = [int(key) for key in old_contents if key not in new_by_index]
+    for indexes in diff.values():
+        indexes.sort()
+    return diff
+
+
+def stage_delta(folder, staging, contents, indexes):
+    """
+    Hardlinks the title files and the content files of the given indexes into
+    staging, giving the decryptor a CDN folder holding only what changed.
+    Content 0 (the FST) is always staged.
+    """
+    os.makedirs(staging, exist_ok=True)
+    names = {name.lower(): name for name in os.listdir(folder)}
+    wanted = set(indexes) | {0}
+
+    staged = []
+    for name in TITLE_FILES:
+        if name in names:
+            staged.append(names[name])
+    for record in contents:
+        if record["index"] not in wanted:
+            continue
+        for suffix in (".app", ".h3", ""):
+            name = names.get(record["id"].lower() + suffix)
+            if name:
+                staged.append(name)
+
+    for name in staged:
+        src = os.path.join(folder, name)
+        dst = os.path.join(staging, name)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+    return staged
+
+
+def _decrypt_into(source, output_dir, decrypt, title_id):
+    """
+    Runs the decryptor on source into output_dir/.delta and merges the result
+    into output_dir, so an existing tree is updated file by file instead of
+    the decryptor moving its folders into (or under) the old ones.
+
+    Returns:
+        dict: Files produced, relative path → title_id.
+    """
+    out_staging = os.path.join(output_dir, ".delta")
+    shutil.rmtree(out_staging, ignore_errors=True)
+    try:
+        os.makedirs(out_staging)
+        decrypt(source, out_staging)
+        produced = {"files": {}}
+        merge_layer(out_staging, output_dir, title_id, produced)
+    finally:
+        shutil.rmtree(out_staging, ignore_errors=True)
+    return produced["files"]
+
+
+def _drop_unproduced(output_dir, produced):
+    """
+    Removes the files of the decrypted folders that a full decryption did not
+    produce, and the directories left empty.
+
+    Returns:
+        int: Number of files removed.
+    """
+    removed = 0
+    for top in DECRYPTED_DIRS:
+        for dirpath, _dirnames, filenames in os.walk(os.path.join(output_dir, top), topdown=False):
+            for fname in filenames:
+                path = os.path.join(dirpath, fname)
+                rel = os.path.relpath(path, output_dir).replace(os.sep, "/")
+                if rel not in produced:
+                    os.remove(path)
+                    removed += 1
+            if not os.listdir(dirpath):
+                os.rmdir(dirpath)
+    return removed
+
+
+def full_decrypt(folder, output_dir, decrypt, progress):
+    """
+    Decrypts every content of folder into output_dir. Over an existing output
+    the tree goes through a staging folder and is merged in, and files the new
+    version did not produce are removed, so nothing stale or nested is left.
+
+    Returns:
+        bool: False if the decryption produced no files, the output is left alone.
+    """
+    if not os.path.isdir(output_dir) or not os.listdir(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        decrypt(folder, output_dir)
+        return any(os.path.isdir(os.path.join(output_dir, top)) for top in DECRYPTED_DIRS)
+
+    title_id = read_tmd_title_id(os.path.join(folder, "title.tmd"))
+    produced = _decrypt_into(folder, output_dir, decrypt, title_id)
+    if not produced:
+        return False
+    removed = _drop_unproduced(output_dir, produced)
+    progress.info(f"📦 Replaced the output: {len(produced)} file(s) written, {removed} stale file(s) removed")
+    return True
+
+
+def apply_delta(folder, output_dir, decrypt, progress, fst=None, partial=False):
+    """
+    Brings an already decrypted output up to the TMD in folder, decrypting
+    only the added or changed contents, or every content when the file table
+    changed and no FST tells which files went away.
+
+    Only decryptors that accept a partial folder (partial set) get a true
+    delta. CDecrypt does not, and does not expose the FST either, so with it
+    any change decrypts every content in one pass; what the recorded state
+    still saves is the run on an unchanged title and the stale files of the
+    previous version.
+
+    Args:
+        folder (str): Prepared CDN folder holding the new title.tmd
+        output_dir (str): Output of a previous run, with its recorded state
+        decrypt: Callable (cdn_folder, output_dir) running the decryptor
+        progress (Progress): Receives the progress events
+        fst: Optional FST of the new version, used to map files to contents
+        partial (bool): The decryptor works from a folder holding only
+                        some of the contents
+
+    Returns:
+        dict or None: The content diff, or None when a full decryption is
+                      needed: no recorded state, or state of another title.
+    """
+    state = load_state(output_dir)
+    if state is None:
+        return None
+
+    tmd_path = os.path.join(folder, "title.tmd")
+    title_id = read_tmd_title_id(tmd_path)
+    if state.get("title_id") != title_id:
+        # Outputs are named after the game, which updates and other regions share
+        progress.warning(f"Output was decrypted from {state.get('title_id')}, not {title_id}: decrypting in full")
+        return None
+
+    new_contents = read_tmd_contents(tmd_path)
+    diff = diff_contents(state["contents"], new_contents)
+    touched = diff["added"] + diff["changed"]
+
+    if not touched and not diff["removed"]:
+        progress.info("✅ Output already matches this TMD, nothing to decrypt")
+        return diff
+
+    # Without an FST the owner of each file is unknown. While the file table
+    # (content 0) is unchanged every path stays where it was and changed
+    # contents just overwrite their files; otherwise every content is
+    # decrypted so files missing from the new tree can be found
+    rebuild = fst is None and (diff["removed"] or 0 not in diff["unchanged"])
+    if not partial:
+        size = sum(c["size"] for c in new_contents)
+        progress.info(f"🔁 {len(touched)} content(s) changed: decrypting all {len(new_contents)} ({size} bytes), "
+                      f"the decryptor needs the complete folder")
+        rebuild = True
+    elif rebuild:
+        size = sum(c["size"] for c in new_contents)
+        progress.info(f"🔁 File table changed: decrypting all {len(new_contents)} content(s) ({size} bytes) to find removed files")
+    else:
+        size = sum(c["size"] for c in new_contents if c["index"] in touched)
+        progress.info(f"🔁 Delta: {len(touched)} content(s) to decrypt ({size} bytes), {len(diff['removed'])} removed")
+
+    cdn_staging = os.path.join(folder, ".delta")
+    shutil.rmtree(cdn_staging, ignore_errors=True)
+    try:
+        source = folder
+        if not rebuild:
+            stage_delta(folder, cdn_staging, new_contents, touched)
+            source = cdn_staging
+        produced = _decrypt_into(source, output_dir, decrypt, state["title_id"])
+    finally:
+        shutil.rmtree(cdn_staging, ignore_errors=True)
+
+    if (touched or rebuild) and not produced:
+        # Decryptor could not work from the partial folder, leave the output alone
+        progress.warning("Delta decryption produced no files, a full decryption is needed")
+        return None
+
+    # 🧹 Drop files the new version no longer has: after a rebuild that is
+    # everything it did not produce, otherwise what the new FST does not list
+    files = state["files"]
+    if rebuild:
+        removed_files = _drop_unproduced(output_dir, produced)
+        files = state["files"] = {}
+    else:
+        removed_files = 0
+        for rel in list(files):
+            if rel not in produced and fst is not None and fst.lookup(rel) is None:
+                path = os.path.join(output_dir, rel)
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed_files += 1
+                del files[rel]
+
+    for rel in produced:
+        index = fst.lookup(rel) if fst is not None else None
+        files[rel] = fst.contents[index] if index is not None else None
+
+    state["version"] = read_tmd_version(tmd_path)
+    state["contents"] = {str(c["index"]): c for c in new_contents}
+    write_state(output_dir, state)
+
+    progress.info(f"📦 Delta applied: {len(produced)} file(s) rewritten, {removed_files} removed")
+    return diff
@@ -0,0 +1,176 @@
+import os
+import sys
+from array import array
+
+FST_MAGIC = b"FST\x00"
+HEADER_SIZE = 0x20
+CLUSTER_SIZE = 0x20  # Secondary header per content
+ENTRY_SIZE = 0x10
+
+TYPE_DIRECTORY = 0x01
+TYPE_IGNORED = 0x80  # Entry is not part of the package
+
+
+def _be_array(typecode, raw):
+    """Big-endian buffer → native array."""
+    values = array(typecode)
+    values.frombytes(raw)
+    if sys.byteorder == "little":
+        values.byteswap()
+    return values
+
+
+class FST:
+    """
+    File system table of a decrypted Wii U title.
+
+    Entries are kept in parallel arrays over the raw name table rather than
+    one object per entry, so a 100k entry table costs a few MB. Paths are
+    only built when asked for.
+
+    Per entry index:
+        types       entry type (TYPE_DIRECTORY, TYPE_IGNORED)
+        name_offs   offset of the name in the name table
+        parents     enclosing directory
+        nexts       for directories, index one past their last child
+        contents    content (cluster) index holding the file data
+        offsets     raw file offset, multiply by offset_factor
+        sizes       file size
+        flags       entry flags
+    """
+
+    def __init__(self, raw):
+        raw = memoryview(raw)
+        if bytes(raw[:4]) != FST_MAGIC:
+            raise ValueError("Not an FST: bad magic.")
+
+        header = _be_array("I", raw[4:12])
+        self.offset_factor = header[0]
+        self.cluster_count = header[1]
+
+        entries_start = HEADER_SIZE + self.cluster_count * CLUSTER_SIZE
+        if len(raw) < entries_start + ENTRY_SIZE:
+            raise ValueError("FST is truncated.")
+
+        # Root entry's size field holds the total entry count
+        count = _be_array("I", raw[entries_start + 8:entries_start + 12])[0]
+        entries_end = entries_start + count * ENTRY_SIZE
+        if count == 0 or len(raw) < entries_end:
+            raise ValueError(f"FST is truncated: expected {count} entries.")
+
+        block = raw[entries_start:entries_end]
+        words = _be_array("I", block)
+        halves = _be_array("H", block)
+
+        self.count = count
+        self.types = array("B", block[0::ENTRY_SIZE].tobytes())
+        self.name_offs = array("I", (w & 0xFFFFFF for w in words[0::4]))
+        self.offsets = words[1::4]
+        self.sizes = words[2::4]
+        self.flags = halves[6::8]
+        self.contents = halves[7::8]
+        self.names = bytes(raw[entries_end:])
+        self.parents, self.nexts = self._link(count)
+        self._index = None
+
+    @classmethod
+    def from_file(cls, fst_path):
+        if not os.path.exists(fst_path):
+            raise FileNotFoundError("FST not found at specified path.")
+        with open(fst_path, "rb") as f:
+            return cls(f.read())
+
+    def __len__(self):
+        return self.count
+
+    def _link(self, count):
+        """Resolves the enclosing directory of every entry in one pass."""
+        parents = array("I", bytes(4 * count))
+        nexts = array("I", range(1, count + 1))
+        types, sizes, offsets = self.types, self.sizes, self.offsets
+
+        dir_stack = [0]
+        end_stack = [count]
+        for i in range(1, count):
+            while i >= end_stack[-1]:
+                dir_stack.pop()
+                end_stack.pop()
+            parents[i] = dir_stack[-1]
+            if types[i] & TYPE_DIRECTORY:
+                # Directories store their parent in the offset field
+                parents[i] = offsets[i]
+                nexts[i] = sizes[i]
+                dir_stack.append(i)
+                end_stack.append(sizes[i])
+        nexts[0] = count
+        return parents, nexts
+
+    def is_dir(self, index):
+        return bool(self.types[index] & TYPE_DIRECTORY)
+
+    def name(self, index):
+        start = self.name_offs[index]
+        end = self.names.index(b"\x00", start)
+        return self.names[start:end].decode("utf-8", errors="replace")
+
+    def file_offset(self, index):
+        """Byte offset of a file's data inside its content."""
+        return self.offsets[index] * self.offset_factor
+
+    def path(self, index):
+        """Full '/'-separated path of an entry, relative to the root."""
+        parts = []
+        while index:
+            parts.append(self.name(index))
+            index = self.parents[index]
+        return "/".join(reversed(parts))
+
+    def files(self, include_ignored=False):
+        """Yields the index of every file entry."""
+        types = self.types
+        for i in range(1, self.count):
+            kind = types[i]
+            if kind & TYPE_DIRECTORY:
+                continue
+            if kind & TYPE_IGNORED and not include_ignored:
+                continue
+            yield i
+
+    def iter_paths(self, include_ignored=False):
+        """
+        Yields (index, path) for every file, building each directory prefix once.
+        """
+        types, nexts = self.types, self.nexts
+        prefixes = [""]
+        ends = [self.count]
+        for i in range(1, self.count):
+            while i >= ends[-1]:
+                prefixes.pop()
+                ends.pop()
+            kind = types[i]
+            if kind & TYPE_DIRECTORY:
+                prefixes.append(prefixes[-1] + self.name(i) + "/")
+                ends.append(nexts[i])
+            elif include_ignored or not kind & TYPE_IGNORED:
+                yield i, prefixes[-1] + self.name(i)
+
+    def entries(self):
+        """Yields (path, size) for every file, in the form OutputWriter.plan takes."""
+        sizes = self.sizes
+        for i, path in self.iter_paths():
+            yield path, sizes[i]
+
+    def build_index(self):
+        """Builds the optional path → index lookup table."""
+        self._index = {path: i for i, path in self.iter_paths(include_ignored=True)}
+        return self._index
+
+    def lookup(self, path):
+        """Returns the entry index of a file path, or None."""
+        if self._index is None:
+            self.build_index()
+        return self._index.get(path.strip("/"))
+
+
+def read_fst(fst_path):
+    return FST.from_file(fst_path)
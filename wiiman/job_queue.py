@@ -0,0 +1,343 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import hashlib
+import logging
+import argparse
+import threading
+from wiiman import memprofile
+from wiiman.progress import Progress, LogSink
+from wiiman.title_group import group_cdn_folders, title_family, publish_output
+
+# 📂 Queue layout, one sub-folder per job state
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, CLAIMED, DONE, FAILED)
+
+# Claimed jobs are named <job_id>@<worker_id>.json, their mtime is the lease heartbeat
+OWNER_SEP = "@"
+
+LEASE_TTL = 120       # Seconds without a heartbeat before a job is reclaimed
+POLL_INTERVAL = 2.0
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}".replace(OWNER_SEP, "_")
+
+
+def init_queue(queue_dir):
+    for state in STATES:
+        os.makedirs(os.path.join(queue_dir, state), exist_ok=True)
+
+
+def _write_json(path, data):
+    """Writes through a temp file and a rename so readers never see partial JSON."""
+    tmp_path = f"{path}.tmp-{default_worker_id()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _job_id(folders):
+    folders = sorted(os.path.abspath(folder) for folder in folders)
+    digest = hashlib.sha1("\n".join(folders).encode("utf-8")).hexdigest()[:12]
+    name = "".join(c if c.isalnum() or c in "-_" else "_" for c in os.path.basename(folders[0]))
+    return f"{name}-{digest}"
+
+
+def enqueue(queue_dir, layers, output_root):
+    """
+    Adds one title family to the queue unless it is already queued or done.
+    Failed jobs can be queued again.
+
+    Base, update and DLC share a game name, so they are processed and
+    published together as one job rather than racing for the same output.
+
+    Args:
+        queue_dir (str): Queue folder
+        layers (list): Layer dicts of one family, as returned by group_cdn_folders
+        output_root (str): Folder the merged output is published to
+
+    Returns:
+        str or None: The job ID, or None if the job already exists.
+    """
+    init_queue(queue_dir)
+    layers = [dict(layer, folder=os.path.abspath(layer["folder"])) for layer in layers]
+    job_id = _job_id([layer["folder"] for layer in layers])
+
+    for state in (PENDING, CLAIMED, DONE):
+        for name in os.listdir(os.path.join(queue_dir, state)):
+            if name.split(OWNER_SEP)[0].removesuffix(".json") == job_id:
+                return None
+
+    job = {
+        "id": job_id,
+        "family": title_family(layers[0]["title_id"]),
+        "layers": layers,
+        "output_root": os.path.abspath(output_root),
+        "attempts": 0,
+    }
+    _write_json(os.path.join(queue_dir, PENDING, f"{job_id}.json"), job)
+    return job_id
+
+
+def enqueue_folders(queue_dir, folders, output_root):
+    """
+    Groups CDN folders by title family and queues one job per family.
+
+    Returns:
+        dict: family → job ID, or None for families already queued.
+    """
+    return {
+        family: enqueue(queue_dir, layers, output_root)
+        for family, layers in group_cdn_folders(folders).items()
+    }
+
+
+def claim(queue_dir, worker_id):
+    """
+    Claims the next pending job. The rename into claimed/ is atomic, so when
+    several workers race for a job exactly one of them gets it.
+
+    Returns:
+        tuple or None: (job, claimed_path)
+    """
+    pending_dir = os.path.join(queue_dir, PENDING)
+    for name in sorted(os.listdir(pending_dir)):
+        if not name.endswith(".json"):
+            continue
+        src = os.path.join(pending_dir, name)
+        dst = os.path.join(queue_dir, CLAIMED, f"{name[:-5]}{OWNER_SEP}{worker_id}.json")
+        try:
+            # Touch first: the rename keeps the mtime, which is the lease
+            os.utime(src)
+            os.rename(src, dst)
+        except FileNotFoundError:
+            continue  # Another worker won this one
+
+        job = _read_json(dst)
+        job["attempts"] = job.get("attempts", 0) + 1
+        job["worker"] = worker_id
+        _write_json(dst, job)
+        return job, dst
+    return None
+
+
+def heartbeat(claimed_path):
+    """Renews the lease. Returns False when the job was reclaimed by someone else."""
+    try:
+        os.utime(claimed_path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def reclaim_expired(queue_dir, lease_ttl=LEASE_TTL):
+    """
+    Moves claimed jobs whose lease expired back to pending.
+
+    Returns:
+        int: Number of jobs reclaimed.
+    """
+    claimed_dir = os.path.join(queue_dir, CLAIMED)
+    now = time.time()
+    reclaimed = 0
+    for name in os.listdir(claimed_dir):
+        if not name.endswith(".json") or OWNER_SEP not in name:
+            continue
+        path = os.path.join(claimed_dir, name)
+        try:
+            if now - os.stat(path).st_mtime < lease_ttl:
+                continue
+            job_id = name.split(OWNER_SEP)[0]
+            os.rename(path, os.path.join(queue_dir, PENDING, f"{job_id}.json"))
+        except FileNotFoundError:
+            continue  # Finished or reclaimed meanwhile
+        logging.warning(f"♻️ Reclaimed expired job {job_id} from {name[len(job_id) + 1:-5]}")
+        reclaimed += 1
+    return reclaimed
+
+
+def complete(queue_dir, claimed_path, job, state, error=None):
+    """
+    Moves a claimed job to done/ or failed/.
+
+    Returns:
+        bool: False if the lease was lost before completion.
+    """
+    if not heartbeat(claimed_path):
+        return False
+
+    job = dict(job, finished=time.time())
+    if error:
+        job["error"] = error
+    try:
+        _write_json(claimed_path, job)
+        os.rename(claimed_path, os.path.join(queue_dir, state, f"{job['id']}.json"))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, claimed_path, interval):
+        super().__init__(daemon=True)
+        self.claimed_path = claimed_path
+        self.interval = interval
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            if not heartbeat(self.claimed_path):
+                self.lost = True
+                return
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_job(queue_dir, job, claimed_path, handler, worker_id, lease_ttl, progress):
+    """
+    Runs one claimed job, publishing its output only while the lease is held.
+
+    Publishing is two renames (see title_group.publish_output), not an
+    atomic swap: the previous output is briefly missing in between. A
+    failed publish fails the job and removes its staging folder.
+    """
+    staging = os.path.join(job["output_root"], f".part-{job['id']}-{worker_id}")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    beat = _Heartbeat(claimed_path, max(lease_ttl / 4, 0.05))
+    beat.start()
+    try:
+        with memprofile.stage("job"):
+            name = handler(job, staging, progress)
+        if not os.listdir(staging):
+            raise RuntimeError("Decryption produced no output")
+    except Exception as e:
+        beat.stop()
+        shutil.rmtree(staging, ignore_errors=True)
+        progress.error(f"Job {job['id']} failed: {e}")
+        complete(queue_dir, claimed_path, job, FAILED, error=str(e))
+        return False
+    beat.stop()
+
+    if beat.lost or not heartbeat(claimed_path):
+        # Someone else owns the job now, their output wins
+        shutil.rmtree(staging, ignore_errors=True)
+        progress.warning(f"Lease lost for job {job['id']}, discarding output")
+        return False
+
+    final_dir = os.path.join(job["output_root"], name)
+    try:
+        publish_output(staging, final_dir, worker_id)
+    except OSError as e:
+        shutil.rmtree(staging, ignore_errors=True)
+        progress.error(f"Job {job['id']} could not be published to {final_dir}: {e}")
+        complete(queue_dir, claimed_path, job, FAILED, error=str(e))
+        return False
+    complete(queue_dir, claimed_path, dict(job, output=final_dir), DONE)
+    progress.info(f"📦 Published {job['id']} to {final_dir}")
+    return True
+
+
+def run_worker(queue_dir, handler=None, worker_id=None, lease_ttl=LEASE_TTL,
+               poll_interval=POLL_INTERVAL, exit_when_empty=True, progress=None):
+    """
+    Pulls jobs from a shared-directory queue until it is empty (or forever
+    when exit_when_empty is False).
+
+    Args:
+        queue_dir (str): Queue folder on the shared filesystem
+        handler: Callable (job, staging_dir, progress) → output folder name,
+                 defaults to pipeline.process_job which merges the family
+        worker_id (str): Unique worker name, defaults to host-pid
+        lease_ttl (float): Seconds without heartbeat before a job is reclaimed
+        poll_interval (float): Seconds to wait when nothing is pending
+        exit_when_empty (bool): Stop once nothing is pending or claimed
+        progress (Progress): Receives the progress events, logged by default
+
+    Returns:
+        int: Number of jobs completed successfully by this worker.
+    """
+    if handler is None:
+        from wiiman.pipeline import process_job
+        handler = process_job
+    worker_id = worker_id or default_worker_id()
+    progress = progress or Progress(LogSink(), source=worker_id)
+    init_queue(queue_dir)
+
+    completed = 0
+    while True:
+        reclaim_expired(queue_dir, lease_ttl)
+        claimed = claim(queue_dir, worker_id)
+        if claimed is None:
+            if exit_when_empty and not os.listdir(os.path.join(queue_dir, CLAIMED)):
+                return completed
+            time.sleep(poll_interval)
+            continue
+
+        job, claimed_path = claimed
+        progress.info(f"🔧 {worker_id} processing family {job['family']} ({len(job['layers'])} folder(s))")
+        if run_job(queue_dir, job, claimed_path, handler, worker_id, lease_ttl, progress):
+            completed += 1
+
+
+def queue_status(queue_dir):
+    """Returns the number of jobs in every state."""
+    return {
+        state: len([n for n in os.listdir(os.path.join(queue_dir, state)) if n.endswith(".json")])
+        for state in STATES
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared-directory job queue for CDN folders")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    add = sub.add_parser("enqueue", help="Queue CDN folders, one job per title family")
+    add.add_argument("queue")
+    add.add_argument("folders", nargs="+")
+    add.add_argument("--output", required=True, help="Folder the decrypted titles are published to")
+
+    work = sub.add_parser("worker", help="Process queued jobs")
+    work.add_argument("queue")
+    work.add_argument("--lease-ttl", type=float, default=LEASE_TTL)
+    work.add_argument("--forever", action="store_true", help="Keep polling when the queue is empty")
+    work.add_argument("--memprofile", metavar="REPORT", help="Profile memory per stage and write a JSON report")
+
+    status = sub.add_parser("status", help="Show job counts")
+    status.add_argument("queue")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "enqueue":
+        for family, job_id in enqueue_folders(args.queue, args.folders, args.output).items():
+            print(f"{family}: {job_id or 'already queued'}")
+    elif args.command == "worker":
+        if args.memprofile:
+            memprofile.enable(args.memprofile)
+        run_worker(args.queue, lease_ttl=args.lease_ttl, exit_when_empty=not args.forever)
+    else:
+        init_queue(args.queue)
+        for state, count in queue_status(args.queue).items():
+            print(f"{state}: {count}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,42 @@ import csv
 import os
 import logging
 
+def resolve_columns(headers):
+    """
+    Finds the Title ID, Title Key and Name columns of the key database,
+    tolerating BOMs and loose header names.
+
+    Returns:
+        tuple: (title_id_col, title_key_col, name_col), None where missing.
+    """
+    def find(label):
+        return next((i for i, h in enumerate(headers) if label in h.upper()), None)
+
+    return find("TITLE ID"), find("TITLE KEY"), find("NAME")
+
+
+def iter_key_rows(csv_path):
+    """
+    Yields (title_id, title_key, name) for every row of the key database,
+    with None for a missing column. Rows stay plain lists while reading.
+    """
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        headers = next(reader, [])
+
+        # 🔍 Resolve columns once with BOM-safe logic
+        title_id_col, title_key_col, name_col = resolve_columns(headers)
+        if title_id_col is None:
+            raise ValueError("Title ID column not found in CSV headers.")
+        logging.debug(f"Using Title ID column: {headers[title_id_col]}")
+
+        def cell(row, col):
+            return row[col] if col is not None and col < len(row) else None
+
+        for row in reader:
+            yield cell(row, title_id_col), cell(row, title_key_col), cell(row, name_col)
+
+
 def match_title_id_exact(title_id_hex, csv_path):
     """
     Searches for a row in the given CSV where Title ID matches exactly.
@@ -14,38 +50,23 @@ def match_title_id_exact(title_id_hex, csv_path):
     Returns:
         dict or None: Matching row with normalized keys, or None.
     """
-    try:
-        with open(csv_path, newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
+    wanted = title_id_hex.strip().upper()
 
-            # 🔍 Resolve Title ID column with BOM-safe logic
-            title_id_key = next(
-                (key for key in reader.fieldnames if "TITLE ID" in key.upper()),
-                None
-            )
-
-            if not title_id_key:
-                logging.warning("Title ID column not found in CSV headers.")
-                return None
-
-            logging.debug(f"Using Title ID column: {title_id_key}")
-
-            for row in reader:
-                csv_id = row.get(title_id_key, "").strip().upper()
-                if csv_id == title_id_hex.strip().upper():
-                    logging.info(f"✅ Match found for Title ID: {csv_id}")
-
-                    # 🧠 Dynamically resolve name key and add normalized data
-                    name_key = next((k for k in row.keys() if "NAME" in k.upper()), None)
-                    title_key_key = next((k for k in row.keys() if "TITLE KEY" in k.upper()), None)
+    try:
+        for title_id, title_key, name in iter_key_rows(csv_path):
+            csv_id = (title_id or "").strip().upper()
+            if csv_id == wanted:
+                logging.info(f"✅ Match found for Title ID: {csv_id}")
 
-                    return {
-                        "Title ID": csv_id,
-                        "Title Key": row.get(title_key_key, "Unknown"),
-                        "Name": row.get(name_key, "Unknown")
-                    }
+                return {
+                    "Title ID": csv_id,
+                    "Title Key": title_key if title_key is not None else "Unknown",
+                    "Name": name if name is not None else "Unknown"
+                }
 
+    except ValueError as e:
+        logging.warning(str(e))
     except Exception as e:
         logging.error(f"[ERROR] Failed to read CSV: {e}")
 
-    return None
\ No newline at end of file
+    return None
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import atexit
+import logging
+import tracemalloc
+from contextlib import nullcontext
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+# 🧠 Set to a file path to profile every run and write the report there at exit
+ENV_VAR = "WIIDCRYPT_MEMPROFILE"
+
+TOP_SITES = 10
+TRACE_FRAMES = 1
+
+
+class MemoryBudgetExceeded(AssertionError):
+    pass
+
+
+def _rss_bytes():
+    """Current resident set size, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_bytes(who=None):
+    """Peak resident set size of this process (or its children)."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who is None else who)
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+class MemoryProfiler:
+    """
+    Records per-stage memory use: tracemalloc peak and top allocation sites
+    for Python allocations, plus process RSS (which also covers C buffers
+    and mmaps that tracemalloc does not see).
+
+    Stages may nest; an outer stage's peak includes its inner stages.
+
+    Usage:
+        profiler = MemoryProfiler()
+        with profiler.stage("decrypt"):
+            ...
+        profiler.assert_budget("decrypt", 8 * 1024 * 1024)
+    """
+
+    def __init__(self, top=TOP_SITES):
+        self.top = top
+        self.stages = []
+        self._stack = []
+        self._started = False
+
+    def stage(self, name):
+        return _ProfiledStage(self, name)
+
+    def _enter(self, name):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            self._started = True
+        if self._stack:
+            parent = self._stack[-1]
+            parent["max_peak"] = max(parent["max_peak"], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        self._stack.append({
+            "name": name,
+            "start": current,
+            "max_peak": current,
+            "rss_peak_start": _peak_rss_bytes(),
+            "snapshot": tracemalloc.take_snapshot() if self.top else None,
+        })
+
+    def _exit(self):
+        frame = self._stack.pop()
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, frame["max_peak"])
+        if self._stack:
+            parent = self._stack[-1]
+            parent["max_peak"] = max(parent["max_peak"], peak)
+
+        top = []
+        if frame["snapshot"] is not None:
+            diff = tracemalloc.take_snapshot().compare_to(frame["snapshot"], "lineno")
+            for stat in diff[:self.top]:
+                if stat.size_diff <= 0:
+                    continue
+                where = stat.traceback[0]
+                top.append({
+                    "site": f"{where.filename}:{where.lineno}",
+                    "size": stat.size_diff,
+                    "count": stat.count_diff,
+                })
+
+        rss_peak = _peak_rss_bytes()
+        self.stages.append({
+            "stage": frame["name"],
+            "peak": peak - frame["start"],
+            "retained": current - frame["start"],
+            "rss": _rss_bytes(),
+            "rss_peak": rss_peak,
+            # Growth of the process high-water mark, only meaningful when the
+            # stage runs in a process that has not peaked higher before
+            "rss_growth": rss_peak - frame["rss_peak_start"] if rss_peak is not None else None,
+            "children_rss_peak": _peak_rss_bytes(resource.RUSAGE_CHILDREN) if resource else None,
+            "top": top,
+        })
+
+        # Tracing slows every allocation down, only keep it on inside stages
+        if not self._stack and self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def stage_peak(self, name):
+        """Largest peak recorded for a stage name."""
+        peaks = [s["peak"] for s in self.stages if s["stage"] == name]
+        if not peaks:
+            raise KeyError(f"No stage named {name!r} was profiled")
+        return max(peaks)
+
+    def assert_budget(self, name, peak_bytes):
+        """Raises MemoryBudgetExceeded if a stage's traced peak went over budget."""
+        peak = self.stage_peak(name)
+        if peak > peak_bytes:
+            raise MemoryBudgetExceeded(
+                f"Stage {name!r} peaked at {peak} bytes, budget is {peak_bytes} bytes"
+            )
+
+    def assert_rss_budget(self, name, growth_bytes, children_bytes=None):
+        """
+        Raises MemoryBudgetExceeded if a stage grew the process peak RSS by more
+        than growth_bytes, or a child process (the decryptor) peaked over
+        children_bytes. Unlike assert_budget this covers C buffers and mmaps.
+        """
+        stages = [s for s in self.stages if s["stage"] == name]
+        if not stages:
+            raise KeyError(f"No stage named {name!r} was profiled")
+        for s in stages:
+            if s["rss_growth"] is not None and s["rss_growth"] > growth_bytes:
+                raise MemoryBudgetExceeded(
+                    f"Stage {name!r} grew peak RSS by {s['rss_growth']} bytes, budget is {growth_bytes} bytes"
+                )
+            if children_bytes is not None and (s["children_rss_peak"] or 0) > children_bytes:
+                raise MemoryBudgetExceeded(
+                    f"Stage {name!r} child processes peaked at {s['children_rss_peak']} bytes RSS, "
+                    f"budget is {children_bytes} bytes"
+                )
+
+    def check_budgets(self, budgets):
+        """assert_budget for every stage → bytes in budgets."""
+        for name, peak_bytes in budgets.items():
+            self.assert_budget(name, peak_bytes)
+
+    def report(self):
+        return {"stages": self.stages, "rss_peak": _peak_rss_bytes()}
+
+    def format_report(self):
+        lines = []
+        for s in self.stages:
+            lines.append(f"🧠 {s['stage']}: peak {s['peak'] / 1024:.1f} KiB, "
+                         f"retained {s['retained'] / 1024:.1f} KiB, "
+                         f"rss {(s['rss'] or 0) / 1048576:.1f} MiB")
+            for site in s["top"]:
+                lines.append(f"    {site['size'] / 1024:.1f} KiB in {site['count']} block(s) at {site['site']}")
+        return "\n".join(lines)
+
+    def write_report(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+class _ProfiledStage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._enter(self.name)
+        return self.profiler
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler._exit()
+
+
+# 🔌 Module-level profiler used by the pipeline, None when profiling is off
+_active = None
+
+
+def enable(report_path=None, top=TOP_SITES):
+    """Turns profiling on for the pipeline stages, writing report_path at exit."""
+    global _active
+    _active = MemoryProfiler(top=top)
+    if report_path:
+        atexit.register(_write_at_exit, _active, report_path)
+    return _active
+
+
+def disable():
+    global _active
+    _active = None
+
+
+def active():
+    return _active
+
+
+def stage(name):
+    """Profiles a pipeline stage when profiling is enabled, otherwise does nothing."""
+    if _active is None:
+        return nullcontext()
+    return _active.stage(name)
+
+
+def _write_at_exit(profiler, path):
+    profiler.write_report(path)
+    logging.info(f"🧠 Memory report written to {path}\n{profiler.format_report()}")
+
+
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR])
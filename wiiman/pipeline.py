@@ -0,0 +1,202 @@
+import os
+import time
+import shutil
+import logging
+from wiiman import memprofile
+from wiiman.rename import rename_extensionless_files, rename_tmd_file
+from wiiman.tmd_handler import handle_tmd_logic, backup_tmd_file
+from wiiman.tmd_parser import read_tmd_title_id, read_tmd_contents
+from wiiman.match_title_id import match_title_id_exact
+from wiiman.decrypt_utils import generate_fake_tik, run_cdecrypt, DECRYPTOR_PARTIAL
+from wiiman.delta import apply_delta, full_decrypt, record_state
+from wiiman.title_group import find_folder_tmd, process_family
+from wiiman.ticket_cache import TicketCache, build_ticket_cache, cache_is_current
+from wiiman.throughput import record_throughput
+
+# 📁 Bundled resources
+WIIMAN_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(WIIMAN_DIR)
+TITLEKEYS_CSV = os.path.join(WIIMAN_DIR, "wiiu_titlekeys.csv")
+DECRYPTOR_PATH = os.path.join(WIIMAN_DIR, "cdecrypt.exe")
+CERT_TEMPLATE = os.path.join(ROOT_DIR, "template", "title.cert")
+TICKET_CACHE = os.path.join(WIIMAN_DIR, "wiiu_titlekeys.tikcache")
+
+# Open ticket caches by path
+_ticket_caches = {}
+
+
+def sanitize_name(name):
+    """Turns a game name into something usable as a folder name."""
+    return name.replace(":", "").replace("/", "-").strip()
+
+
+def ticket_cache_path(csv_path):
+    if csv_path == TITLEKEYS_CSV:
+        return TICKET_CACHE
+    return os.path.splitext(csv_path)[0] + ".tikcache"
+
+
+def open_ticket_cache(csv_path=TITLEKEYS_CSV):
+    """
+    Returns the ticket cache of a key database, rebuilding it first when the
+    database changed. Returns None if the cache cannot be built.
+    """
+    cache_path = ticket_cache_path(csv_path)
+    try:
+        cache = _ticket_caches.get(cache_path)
+        if not cache_is_current(csv_path, cache_path):
+            # An open mapping keeps the file locked on Windows, close it before replacing
+            if cache is not None:
+                _ticket_caches.pop(cache_path).close()
+                cache = None
+            build_ticket_cache(csv_path, cache_path)
+        elif cache is not None and os.path.getmtime(cache_path) != cache.mtime:
+            # Rebuilt by another process, the open mapping is out of date
+            _ticket_caches.pop(cache_path).close()
+            cache = None
+        if cache is None:
+            cache = _ticket_caches[cache_path] = TicketCache(cache_path)
+        return cache
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ticket cache unavailable, building tickets one by one: {e}")
+        return None
+
+
+def write_title_ticket(folder, matched, progress, csv_path=TITLEKEYS_CSV):
+    """
+    Writes title.tik for a matched key database row, from the ticket cache
+    when possible. Raises ValueError for a key the cache rejected.
+    """
+    cache = open_ticket_cache(csv_path)
+    if cache is None:
+        generate_fake_tik(
+            title_id=matched["Title ID"],
+            title_key=matched["Title Key"],
+            output_path=folder,
+            progress=progress
+        )
+    elif cache.write_ticket(matched["Title ID"], folder):
+        progress.info("✅ Generated title.tik")
+    else:
+        raise ValueError(f"Invalid Title Key for {matched['Title ID']}: {matched['Title Key']!r}")
+
+
+def select_title_tmd(folder):
+    """
+    Headless title.tmd resolution: keeps an existing title.tmd, otherwise
+    backs up and promotes the highest numbered tmd.X alternate.
+    """
+    tmd_path = find_folder_tmd(folder)
+    if tmd_path and os.path.basename(tmd_path) != "title.tmd":
+        backup_tmd_file("c", folder, tmd_path)
+        rename_tmd_file(folder, os.path.basename(tmd_path))
+        logging.debug(f"Promoted {os.path.basename(tmd_path)} to title.tmd")
+
+
+def prepare_cdn_folder(folder, progress, csv_path=TITLEKEYS_CSV, interactive=True):
+    """
+    Runs the pre-decryption steps of a CDN folder: renames the content files,
+    resolves title.tmd, looks up the title key and writes title.tik.
+
+    Args:
+        folder (str): CDN folder to prepare
+        progress (Progress): Receives the progress events
+        csv_path (str): Title key database
+        interactive (bool): Ask about title.tmd through dialogs, otherwise
+                            pick it without prompting (see select_title_tmd)
+
+    Returns:
+        tuple: (title_id, matched) where matched is the key database row or None.
+    """
+    with memprofile.stage("rename"):
+        rename_extensionless_files(folder)
+
+    with memprofile.stage("tmd"):
+        if interactive:
+            handle_tmd_logic(folder)
+        else:
+            select_title_tmd(folder)
+
+        title_id = read_tmd_title_id(os.path.join(folder, "title.tmd"))
+        logging.info(f"📦 Extracted Title ID: {title_id}")
+
+    with memprofile.stage("key_lookup"):
+        matched = match_title_id_exact(title_id, csv_path)
+
+    if matched:
+        with memprofile.stage("ticket"):
+            write_title_ticket(folder, matched, progress, csv_path)
+    return title_id, matched
+
+
+def decrypt_cdn_folder(folder, output_dir, progress, decryptor=DECRYPTOR_PATH, incremental=True):
+    """
+    Decrypts a prepared CDN folder into output_dir and drops the title.cert template.
+
+    With incremental set, an output decrypted by an earlier run is brought up
+    to the current title.tmd, see apply_delta: it is left alone when no
+    content changed, and files the new version dropped are removed.
+
+    Returns:
+        bool: False if the decryption failed, the failure is reported through progress.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    decrypt = lambda cdn_folder, out_dir: run_cdecrypt(decryptor, cdn_folder, out_dir, progress)
+    tmd_path = os.path.join(folder, "title.tmd")
+
+    succeeded = True
+    with memprofile.stage("decrypt"):
+        if not incremental or apply_delta(folder, output_dir, decrypt, progress, partial=DECRYPTOR_PARTIAL) is None:
+            started = time.monotonic()
+            succeeded = full_decrypt(folder, output_dir, decrypt, progress)
+            # A failed run must not look like an up to date output to the next
+            # one, nor like a very fast decryption to the estimates
+            if succeeded:
+                _record_decrypt_throughput(tmd_path, time.monotonic() - started)
+                if incremental:
+                    record_state(output_dir, tmd_path)
+
+    shutil.copy2(CERT_TEMPLATE, os.path.join(folder, "title.cert"))
+    return succeeded
+
+
+def _record_decrypt_throughput(tmd_path, seconds):
+    """Feeds the preflight duration estimates with this run."""
+    try:
+        nbytes = sum(c["size"] for c in read_tmd_contents(tmd_path))
+    except (OSError, ValueError):
+        return
+    record_throughput("decrypt", nbytes, seconds)
+
+
+def process_job(job, staging_dir, progress):
+    """
+    Headless per-family pipeline used by queue workers: plans the family,
+    then prepares every layer of job["layers"] and decrypts and merges them
+    into staging_dir.
+
+    Returns:
+        str: Folder name the output should be published under, the base game's
+             name and Title ID, as regions share names.
+    """
+    from wiiman.preflight import plan_layers, blocking_problems
+
+    # 🔍 Fail before renaming or decrypting anything
+    problems = blocking_problems(plan_layers(job["layers"], staging_dir))
+    if problems:
+        raise ValueError("Preflight failed: " + "; ".join(problems))
+
+    names = {}
+    for layer in job["layers"]:
+        title_id, matched = prepare_cdn_folder(layer["folder"], progress, interactive=False)
+        if not matched:
+            raise ValueError(f"No match found for Title ID: {title_id}")
+        names[layer["type"]] = matched["Name"]
+
+    process_family(
+        job["layers"], staging_dir,
+        lambda layer, staging: decrypt_cdn_folder(layer["folder"], staging, progress, incremental=False),
+        progress
+    )
+    game_name = sanitize_name(names.get("base") or next(iter(names.values())))
+    return f"{game_name} [{job['layers'][0]['title_id']}]"
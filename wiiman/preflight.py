@@ -0,0 +1,326 @@
+import os
+import re
+import shutil
+from wiiman.match_title_id import iter_key_rows
+from wiiman.ticket_cache import validate_key_rows
+from wiiman.tmd_parser import read_tmd_title_id, read_tmd_contents
+from wiiman.title_group import find_folder_tmd, title_type, group_cdn_folders, MANIFEST_NAME
+from wiiman.delta import load_state, diff_contents
+from wiiman.decrypt_utils import DECRYPTOR_PARTIAL
+from wiiman.validator import is_valid_cdn_folder
+from wiiman.throughput import load_history, estimate_seconds
+from wiiman.pipeline import TITLEKEYS_CSV, sanitize_name
+
+# 🔍 Preflight only reads metadata: TMDs, directory listings, the key
+# database, output state files and free space. Nothing is renamed or written.
+
+HEX_NAME = re.compile(r"[0-9A-Fa-f]{8}")
+
+
+def load_key_index(csv_path):
+    """
+    Indexes the key database for preflight.
+
+    Returns:
+        dict: upper-case Title ID → {"name", "valid", "reason"}
+    """
+    rows = list(iter_key_rows(csv_path))
+    entries, invalid = validate_key_rows(rows)
+
+    index = {}
+    for title_id, _title_key, name in rows:
+        title_id = (title_id or "").strip().upper()
+        if title_id in entries:
+            index[title_id] = {"name": name, "valid": True, "reason": None}
+    for entry in invalid:
+        if entry["reason"] != "bad Title ID" and entry["title_id"] not in entries:
+            index[entry["title_id"]] = {"name": entry["name"], "valid": False, "reason": entry["reason"]}
+    return index
+
+
+def _existing_ancestor(path):
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def _scan_contents(folder, contents):
+    """Returns (content ids missing from folder, number of files the rename step will touch)."""
+    names = os.listdir(folder)
+    lower = {name.lower() for name in names}
+    missing = [
+        c["id"] for c in contents
+        if c["id"].lower() + ".app" not in lower and c["id"].lower() not in lower
+    ]
+    renames = sum(
+        1 for name in names
+        if HEX_NAME.fullmatch(name) and os.path.isfile(os.path.join(folder, name))
+    )
+    return missing, renames
+
+
+def plan_folder(folder, output_dir, key_index, history, incremental=True, output_root=None):
+    """
+    Plans the processing of one CDN folder without touching it.
+
+    Args:
+        folder (str): CDN folder
+        output_dir (str): Where the decrypted title will go, or None to name
+                          it after the game in output_root
+        key_index (dict): As returned by load_key_index
+        history (list): Throughput history, see wiiman.throughput
+        incremental (bool): Plan a delta when output_dir has recorded state
+        output_root (str): Parent of the default output, defaults to the
+                           folder's parent
+
+    Returns:
+        dict: "folder", "title_id", "type", "name", "output_dir", "actions",
+              "read_bytes", "write_bytes", "estimated_seconds", "problems"
+              (blocking) and "warnings".
+    """
+    plan = {
+        "folder": folder,
+        "title_id": None,
+        "type": None,
+        "name": None,
+        "output_dir": output_dir,
+        "actions": [],
+        "read_bytes": 0,
+        "write_bytes": 0,
+        "estimated_seconds": None,
+        "problems": [],
+        "warnings": [],
+    }
+
+    tmd_path = find_folder_tmd(folder)
+    if tmd_path is None:
+        plan["problems"].append("no title.tmd or tmd.X found")
+        return plan
+    try:
+        title_id = read_tmd_title_id(tmd_path)
+        contents = read_tmd_contents(tmd_path)
+    except (OSError, ValueError, IndexError) as e:
+        plan["problems"].append(f"unreadable TMD {os.path.basename(tmd_path)}: {e}")
+        return plan
+
+    plan["title_id"] = title_id
+    plan["type"] = title_type(title_id)
+    if plan["type"] is None:
+        plan["warnings"].append(f"unknown title type {title_id[:8]}")
+
+    missing, renames = _scan_contents(folder, contents)
+    if renames:
+        plan["actions"].append(f"rename {renames} extensionless content file(s) to .app")
+    if os.path.basename(tmd_path) != "title.tmd":
+        plan["actions"].append(f"promote {os.path.basename(tmd_path)} to title.tmd")
+    if missing:
+        plan["problems"].append(f"{len(missing)} content(s) missing: " + ", ".join(missing[:5])
+                                + (" ..." if len(missing) > 5 else ""))
+
+    key = key_index.get(title_id)
+    if key is None:
+        plan["problems"].append("Title ID not in the key database")
+    elif not key["valid"]:
+        plan["name"] = key["name"]
+        plan["problems"].append(f"key database entry rejected ({key['reason']})")
+    else:
+        plan["name"] = key["name"]
+        plan["actions"].append("write title.tik")
+
+    if plan["output_dir"] is None:
+        game_name = sanitize_name(plan["name"]) if plan["name"] else title_id
+        parent = output_root or os.path.dirname(os.path.abspath(folder))
+        plan["output_dir"] = os.path.join(parent, game_name)
+
+    size = sum(c["size"] for c in contents)
+    state = load_state(plan["output_dir"]) if incremental and os.path.isdir(plan["output_dir"]) else None
+    if state is not None and state.get("title_id") != title_id:
+        plan["warnings"].append(f"output holds {state.get('title_id')}, it will be decrypted over in full")
+        state = None
+    if state is not None:
+        diff = diff_contents(state["contents"], contents)
+        touched = diff["added"] + diff["changed"]
+        if not touched and not diff["removed"]:
+            plan["actions"].append("output already up to date")
+            size = 0
+        elif not DECRYPTOR_PARTIAL or diff["removed"] or 0 not in diff["unchanged"]:
+            # Whole folder needed or file table changed, see apply_delta
+            plan["actions"].append(f"decrypt all {len(contents)} content(s) into the existing output, "
+                                   f"drop files no longer listed")
+        else:
+            size = sum(c["size"] for c in contents if c["index"] in touched)
+            plan["actions"].append(f"delta decrypt {len(touched)} content(s)")
+    else:
+        plan["actions"].append(f"decrypt {len(contents)} content(s)")
+        if os.path.isdir(plan["output_dir"]) and os.listdir(plan["output_dir"]):
+            if os.path.exists(os.path.join(plan["output_dir"], MANIFEST_NAME)):
+                plan["warnings"].append("replaces an existing library output")
+            else:
+                plan["warnings"].append("output exists without recorded state, it will be overwritten")
+
+    plan["read_bytes"] = size
+    plan["write_bytes"] = size
+    plan["estimated_seconds"] = estimate_seconds(history, "decrypt", size) if size else 0.0
+    return plan
+
+
+def check_free_space(plans):
+    """Adds a blocking problem to every plan writing to a device without room for all of them."""
+    devices = {}
+    for plan in plans:
+        if plan["problems"] or not plan["write_bytes"]:
+            continue
+        anchor = _existing_ancestor(plan["output_dir"])
+        device = devices.setdefault(os.stat(anchor).st_dev, {"anchor": anchor, "plans": []})
+        device["plans"].append(plan)
+
+    for device in devices.values():
+        needed = sum(p["write_bytes"] for p in device["plans"])
+        free = shutil.disk_usage(device["anchor"]).free
+        if needed > free:
+            for plan in device["plans"]:
+                plan["problems"].append(
+                    f"not enough space on {device['anchor']}: "
+                    f"{format_size(needed)} needed, {format_size(free)} free"
+                )
+
+
+def plan_library(path, output_root=None, csv_path=None, history=None):
+    """
+    Plans a CDN folder, or every CDN folder of a library, the way the GUI
+    would process them.
+
+    A single folder decrypts next to itself, incrementally. A library groups
+    folders by title family and merges each family into one output named
+    after its base game.
+
+    Args:
+        path (str): CDN folder or library
+        output_root (str): Parent of the outputs, defaults to next to the folders
+        csv_path (str): Title key database, defaults to the bundled one
+        history (list): Throughput history, defaults to the recorded one
+
+    Returns:
+        list: One plan per CDN folder, see plan_folder.
+    """
+    key_index = load_key_index(csv_path or TITLEKEYS_CSV)
+    history = load_history() if history is None else history
+
+    if is_valid_cdn_folder(path):
+        plans = [plan_folder(path, None, key_index, history, output_root=output_root)]
+        check_free_space(plans)
+        return plans
+
+    output_root = path if output_root is None else output_root
+    folders = [
+        os.path.join(path, name) for name in sorted(os.listdir(path))
+        if is_valid_cdn_folder(os.path.join(path, name))
+    ]
+
+    # 🧩 Every layer of a family lands in the base game's output
+    plans = []
+    planned = set()
+    for family, layers in group_cdn_folders(folders).items():
+        names = {l["type"]: key_index.get(l["title_id"], {}).get("name") for l in layers}
+        game_name = names.get("base") or next((n for n in names.values() if n), None)
+        output_dir = os.path.join(output_root, sanitize_name(game_name) if game_name else family)
+        plans += _plan_family(layers, output_dir, key_index, history)
+        planned.update(layer["folder"] for layer in layers)
+
+    for folder in folders:
+        if folder in planned:
+            continue
+        plan = plan_folder(folder, None, key_index, history, incremental=False, output_root=output_root)
+        if not plan["problems"]:
+            plan["problems"].append("not part of any title family, the library run skips it")
+        plans.append(plan)
+
+    plans.sort(key=lambda plan: folders.index(plan["folder"]))
+    check_free_space(plans)
+    return plans
+
+
+def _plan_family(layers, output_dir, key_index, history):
+    plans = [plan_folder(layer["folder"], output_dir, key_index, history, incremental=False) for layer in layers]
+    # A family is skipped as a whole when one of its layers cannot be prepared
+    if any(plan["problems"] for plan in plans):
+        for plan in plans:
+            if not plan["problems"]:
+                plan["problems"].append("another layer of this title family is blocked")
+    return plans
+
+
+def plan_layers(layers, output_dir, csv_path=None, history=None):
+    """
+    Plans one title family merged into output_dir, as queue workers run it.
+
+    Args:
+        layers (list): Layer dicts of one family, as returned by group_cdn_folders
+
+    Returns:
+        list: One plan per layer, see plan_folder.
+    """
+    key_index = load_key_index(csv_path or TITLEKEYS_CSV)
+    history = load_history() if history is None else history
+    plans = _plan_family(layers, output_dir, key_index, history)
+    check_free_space(plans)
+    return plans
+
+
+def blocking_problems(plans):
+    """Returns "folder: problem" lines for every blocking problem of plans."""
+    return [
+        f"{os.path.basename(plan['folder'])}: {problem}"
+        for plan in plans for problem in plan["problems"]
+    ]
+
+
+def format_size(nbytes):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if nbytes < 1024:
+            return f"{nbytes:.0f} {unit}" if unit == "B" else f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TiB"
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "unknown (no throughput history yet)"
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def format_plan(plans):
+    """Human-readable report of a list of plans."""
+    lines = []
+    for plan in plans:
+        status = "❌" if plan["problems"] else "✅"
+        label = plan["name"] or os.path.basename(plan["folder"])
+        lines.append(f"{status} {label} [{plan['title_id'] or '?'}] ({plan['type'] or '?'}) ← {plan['folder']}")
+        if plan["output_dir"]:
+            lines.append(f"    → {plan['output_dir']}")
+        for action in plan["actions"]:
+            lines.append(f"    • {action}")
+        lines.append(f"    read {format_size(plan['read_bytes'])}, write {format_size(plan['write_bytes'])}, "
+                     f"~{format_duration(plan['estimated_seconds'])}")
+        for warning in plan["warnings"]:
+            lines.append(f"    ⚠️ {warning}")
+        for problem in plan["problems"]:
+            lines.append(f"    ❌ {problem}")
+
+    blocked = sum(1 for p in plans if p["problems"])
+    estimates = [p["estimated_seconds"] for p in plans if not p["problems"]]
+    total = None if any(e is None for e in estimates) else sum(estimates)
+    lines.append(f"📋 {len(plans)} title(s), {blocked} blocked, "
+                 f"write {format_size(sum(p['write_bytes'] for p in plans if not p['problems']))}, "
+                 f"~{format_duration(total)}")
+    return "\n".join(lines)
@@ -0,0 +1,290 @@
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+from collections import namedtuple
+
+# 📣 Event kinds
+STAGE_START = "stage_start"
+STAGE_END = "stage_end"
+BYTES = "bytes"
+INFO = "info"
+WARNING = "warning"
+ERROR = "error"
+
+# done/total are bytes for BYTES events; source tells producers apart
+# when events from several threads or processes end up in one place
+ProgressEvent = namedtuple("ProgressEvent", "kind stage message done total time source")
+
+# Seconds between two BYTES events of one reporter
+DEFAULT_INTERVAL = 0.2
+
+
+def format_event(event):
+    """Human readable one-liner for an event."""
+    if event.kind == STAGE_START:
+        return f"▶️ {event.stage}"
+    if event.kind == STAGE_END:
+        return f"⏹️ {event.stage}" + (f": {event.message}" if event.message else "")
+    if event.kind == BYTES:
+        if event.total:
+            percent = 100 * event.done // event.total
+            return f"{event.stage}: {percent}% ({event.done}/{event.total} bytes)"
+        return f"{event.stage}: {event.done} bytes"
+    if event.kind == WARNING:
+        return f"⚠️ {event.message}"
+    if event.kind == ERROR:
+        return f"❌ {event.message}"
+    return event.message
+
+
+class Progress:
+    """
+    Producer side of the progress API.
+
+    Stage and message events go straight to the sinks. Byte counts reported
+    through advance() are coalesced and emitted at most once per interval,
+    so a decrypt loop can call it for every chunk. One reporter can be
+    shared by several threads.
+
+    Usage:
+        progress = Progress(LogSink())
+        with progress.stage("decrypt", total=size):
+            for chunk in chunks:
+                progress.advance(len(chunk))
+    """
+
+    def __init__(self, *sinks, interval=DEFAULT_INTERVAL, source=None):
+        self.sinks = list(sinks)
+        self.interval = interval
+        self.source = source
+        self._lock = threading.Lock()
+        self._stage = None
+        self._done = 0
+        self._total = None
+        self._emitted = 0
+        self._next_emit = 0.0
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def emit(self, kind, message="", stage=None, done=None, total=None):
+        event = ProgressEvent(
+            kind, stage if stage is not None else self._stage, message,
+            done, total, time.time(), self.source
+        )
+        for sink in self.sinks:
+            try:
+                sink(event)
+            except Exception as e:
+                logging.debug(f"Progress sink failed: {e}")
+
+    # 🏁 Stages
+    def start_stage(self, name, total=None):
+        with self._lock:
+            self._stage = name
+            self._done = 0
+            self._emitted = 0
+            self._total = total
+            self._next_emit = 0.0
+        self.emit(STAGE_START, stage=name, done=0, total=total)
+
+    def end_stage(self, message=""):
+        self.flush()
+        stage = self._stage
+        self.emit(STAGE_END, message, stage=stage, done=self._done, total=self._total)
+        with self._lock:
+            self._stage = None
+
+    def stage(self, name, total=None):
+        return _Stage(self, name, total)
+
+    # 📈 Bytes
+    def set_total(self, total):
+        with self._lock:
+            self._total = total
+
+    def advance(self, n):
+        """Adds n bytes to the current stage. Cheap enough for per-chunk calls."""
+        with self._lock:
+            self._done += n
+            now = time.monotonic()
+            if now < self._next_emit:
+                return
+            self._next_emit = now + self.interval
+            done, self._emitted = self._done, self._done
+            total = self._total
+        self.emit(BYTES, done=done, total=total)
+
+    def flush(self):
+        """Emits the latest byte count if it was held back by rate limiting."""
+        with self._lock:
+            if self._done == self._emitted:
+                return
+            done, self._emitted = self._done, self._done
+            total = self._total
+        self.emit(BYTES, done=done, total=total)
+
+    # 💬 Messages
+    def info(self, message):
+        self.emit(INFO, message)
+
+    def warning(self, message):
+        self.emit(WARNING, message)
+
+    def error(self, message):
+        self.emit(ERROR, message)
+
+    def update(self, message):
+        """Accepts the old duck-typed ui.update(msg) calls."""
+        self.info(message)
+
+
+class _Stage:
+    def __init__(self, progress, name, total):
+        self.progress = progress
+        self.name = name
+        self.total = total
+
+    def __enter__(self):
+        self.progress.start_stage(self.name, self.total)
+        return self.progress
+
+    def __exit__(self, exc_type, exc, tb):
+        self.progress.end_stage(f"failed: {exc}" if exc_type else "")
+
+
+# 🔌 Sinks, any callable taking a ProgressEvent works
+
+class LogSink:
+    """Sends events to logging."""
+
+    LEVELS = {WARNING: logging.WARNING, ERROR: logging.ERROR, BYTES: logging.DEBUG}
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger()
+
+    def __call__(self, event):
+        self.logger.log(self.LEVELS.get(event.kind, logging.INFO), format_event(event))
+
+
+class TerminalSink:
+    """Writes events to a terminal, redrawing byte counts on one line."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+        self._inline = False
+
+    def __call__(self, event):
+        text = format_event(event)
+        if event.kind == BYTES and self.stream.isatty():
+            self.stream.write(f"\r{text}\033[K")
+            self._inline = True
+        else:
+            if self._inline:
+                self.stream.write("\n")
+                self._inline = False
+            self.stream.write(text + "\n")
+        self.stream.flush()
+
+
+class JsonLinesSink:
+    """Writes one JSON object per event."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __call__(self, event):
+        self.stream.write(json.dumps(event._asdict(), ensure_ascii=False) + "\n")
+        self.stream.flush()
+
+
+class ListSink:
+    """Keeps every event, for tests."""
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def kinds(self):
+        return [event.kind for event in self.events]
+
+
+class TkSink:
+    """
+    Shows the latest event in a Tk variable. Calls from other threads are
+    handed to the Tk thread through after().
+    """
+
+    def __init__(self, widget, variable):
+        self.widget = widget
+        self.variable = variable
+
+    def __call__(self, event):
+        text = format_event(event)
+        if threading.current_thread() is threading.main_thread():
+            self.variable.set(text)
+            self.widget.update_idletasks()
+        else:
+            self.widget.after(0, self.variable.set, text)
+
+
+class QueueSink:
+    """
+    Forwards events to a queue (queue.Queue or multiprocessing.Queue) so a
+    parent can aggregate them with drain_queue.
+    """
+
+    def __init__(self, event_queue):
+        self.event_queue = event_queue
+
+    def __call__(self, event):
+        self.event_queue.put(tuple(event))
+
+
+def drain_queue(event_queue, *sinks):
+    """
+    Passes every event waiting in event_queue to sinks without blocking.
+
+    Returns:
+        int: Number of events drained.
+    """
+    drained = 0
+    while True:
+        try:
+            item = event_queue.get_nowait()
+        except queue.Empty:
+            return drained
+        event = ProgressEvent(*item)
+        for sink in sinks:
+            sink(event)
+        drained += 1
+
+
+class AggregateSink:
+    """
+    Sums byte progress over every producer, keeping the latest count per
+    (source, stage).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+
+    def __call__(self, event):
+        if event.kind in (BYTES, STAGE_START, STAGE_END) and event.done is not None:
+            with self._lock:
+                self._latest[(event.source, event.stage)] = (event.done, event.total)
+
+    def totals(self):
+        """Returns (done, total) summed over all producers, total None if unknown."""
+        with self._lock:
+            values = list(self._latest.values())
+        done = sum(d for d, _ in values)
+        totals = [t for _, t in values]
+        total = sum(totals) if totals and None not in totals else None
+        return done, total
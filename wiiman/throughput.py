@@ -0,0 +1,55 @@
+import os
+import json
+import time
+import logging
+
+# ⏱️ Recent decryptions, used to estimate how long the next ones take
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "throughput_history.json")
+HISTORY_LIMIT = 50
+
+# Runs shorter than this say more about process start-up than throughput
+MIN_SECONDS = 1.0
+
+
+def load_history(history_path=HISTORY_PATH):
+    if not os.path.exists(history_path):
+        return []
+    try:
+        with open(history_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable throughput history: {e}")
+        return []
+
+
+def record_throughput(stage, nbytes, seconds, history_path=HISTORY_PATH):
+    """Appends one run to the history, keeping the last HISTORY_LIMIT runs."""
+    if seconds < MIN_SECONDS or nbytes <= 0:
+        return
+    history = load_history(history_path)
+    history.append({"stage": stage, "bytes": nbytes, "seconds": seconds, "time": time.time()})
+    history = history[-HISTORY_LIMIT:]
+
+    tmp_path = f"{history_path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(history, f, indent=2)
+        os.replace(tmp_path, history_path)
+    except OSError as e:
+        logging.debug(f"Could not record throughput: {e}")
+
+
+def bytes_per_second(history, stage):
+    """Average throughput of a stage over the history, or None without data."""
+    runs = [r for r in history if r.get("stage") == stage]
+    seconds = sum(r["seconds"] for r in runs)
+    if not seconds:
+        return None
+    return sum(r["bytes"] for r in runs) / seconds
+
+
+def estimate_seconds(history, stage, nbytes):
+    rate = bytes_per_second(history, stage)
+    if rate is None:
+        return None
+    return nbytes / rate
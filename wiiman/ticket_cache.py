@@ -0,0 +1,268 @@
+import os
+import re
+import sys
+import mmap
+import json
+import bisect
+import struct
+import logging
+from wiiman.match_title_id import iter_key_rows
+from wiiman.decrypt_utils import TIK_SIZE, TIK_TITLE_ID_OFFSET, TIK_TITLE_KEY_OFFSET
+
+# 🗃️ Cache layout: header, sorted 8-byte Title IDs, one ticket per Title ID,
+# then the invalid key database rows as JSON
+CACHE_MAGIC = b"WIIDTIK2"
+HEADER = struct.Struct(">8sIII")  # magic, count, record size, invalid rows size
+
+HEX_16 = re.compile(r"[0-9A-Fa-f]{16}")
+HEX_32 = re.compile(r"[0-9A-Fa-f]{32}")
+
+
+def validate_key_rows(rows):
+    """
+    Splits key database rows into valid entries and problems.
+
+    Args:
+        rows: Iterable of (title_id, title_key, name)
+
+    Returns:
+        tuple: (entries, invalid) where entries maps upper-case Title ID →
+               upper-case Title Key and invalid is a list of dicts with
+               "row", "title_id", "name" and "reason".
+    """
+    entries = {}
+    invalid = []
+    for row_number, (title_id, title_key, name) in enumerate(rows, start=2):
+        title_id = (title_id or "").strip()
+        title_key = (title_key or "").strip()
+
+        if not HEX_16.fullmatch(title_id):
+            reason = "bad Title ID"
+        elif not HEX_32.fullmatch(title_key):
+            reason = "bad Title Key"
+        else:
+            title_id, title_key = title_id.upper(), title_key.upper()
+            known = entries.setdefault(title_id, title_key)
+            if known == title_key:
+                continue
+            reason = "conflicting duplicate Title Key"
+
+        invalid.append({"row": row_number, "title_id": title_id, "name": name, "reason": reason})
+    return entries, invalid
+
+
+def encode_tickets(entries):
+    """
+    Builds every ticket in one pass.
+
+    Args:
+        entries (dict): Title ID → Title Key, both hex
+
+    Returns:
+        tuple: (index, records) — sorted raw Title IDs and the tickets in the
+               same order, TIK_SIZE bytes each.
+    """
+    title_ids = sorted(entries)
+    count = len(title_ids)
+
+    # One hex decode for all IDs and one for all keys
+    id_blob = bytes.fromhex("".join(title_ids))
+    key_blob = bytes.fromhex("".join(entries[t] for t in title_ids))
+
+    # Fill the fields column by column: each strided assignment writes one
+    # byte position of every record at once
+    records = bytearray(count * TIK_SIZE)
+    for i in range(8):
+        records[TIK_TITLE_ID_OFFSET + i::TIK_SIZE] = id_blob[i::8]
+    for i in range(16):
+        records[TIK_TITLE_KEY_OFFSET + i::TIK_SIZE] = key_blob[i::16]
+    return id_blob, records
+
+
+def build_ticket_cache(csv_path, cache_path):
+    """
+    Validates the whole key database and writes the ticket cache.
+
+    Returns:
+        list: Invalid rows, see validate_key_rows.
+    """
+    entries, invalid = validate_key_rows(iter_key_rows(csv_path))
+    index, records = encode_tickets(entries)
+
+    invalid_blob = json.dumps(invalid).encode("utf-8")
+
+    tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(CACHE_MAGIC, len(entries), TIK_SIZE, len(invalid_blob)))
+        f.write(index)
+        f.write(records)
+        f.write(invalid_blob)
+    os.replace(tmp_path, cache_path)
+
+    logging.info(f"🎫 Cached {len(entries)} ticket(s) and {len(invalid)} invalid row(s) in {cache_path}")
+    return invalid
+
+
+def format_invalid_rows(invalid):
+    """One line per invalid key database row."""
+    return [
+        f"row {e['row']}: {e['title_id'] or '-'} {' '.join((e['name'] or '').split())} ({e['reason']})"
+        for e in invalid
+    ]
+
+
+def cache_is_current(csv_path, cache_path):
+    """True if cache_path is a ticket cache of this format, newer than the key database."""
+    try:
+        if os.path.getmtime(cache_path) < os.path.getmtime(csv_path):
+            return False
+        with open(cache_path, "rb") as f:
+            return f.read(len(CACHE_MAGIC)) == CACHE_MAGIC
+    except OSError:
+        return False
+
+
+def ensure_ticket_cache(csv_path, cache_path):
+    """
+    Rebuilds the cache if it is missing, in an older format or older than
+    the key database.
+
+    Returns:
+        list or None: Invalid rows when rebuilt, None when the cache was current.
+    """
+    if cache_is_current(csv_path, cache_path):
+        return None
+    return build_ticket_cache(csv_path, cache_path)
+
+
+class _IdIndex:
+    """Sequence view of the sorted Title ID table, for bisect."""
+
+    def __init__(self, buffer, count):
+        self.buffer = buffer
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = HEADER.size + i * 8
+        return self.buffer[start:start + 8]
+
+
+class TicketCache:
+    """
+    Read-only, memory-mapped view of a ticket cache.
+
+    Usage:
+        with TicketCache(cache_path) as cache:
+            cache.write_ticket("000500001010F300", cdn_folder)
+    """
+
+    def __init__(self, cache_path):
+        self.path = cache_path
+        self._file = open(cache_path, "rb")
+        try:
+            self.mtime = os.fstat(self._file.fileno()).st_mtime
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.count, record_size, self._invalid_size = HEADER.unpack_from(self._map)
+            if magic != CACHE_MAGIC or record_size != TIK_SIZE:
+                raise ValueError(f"{cache_path} is not a ticket cache.")
+        except Exception:
+            self.close()
+            raise
+        self._index = _IdIndex(self._map, self.count)
+        self._records_start = HEADER.size + self.count * 8
+        self._invalid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, title_id):
+        return self._find(title_id) is not None
+
+    def close(self):
+        if getattr(self, "_map", None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    @property
+    def invalid(self):
+        """Key database rows rejected when the cache was built, see validate_key_rows."""
+        if self._invalid is None:
+            start = self._offset(self.count)
+            self._invalid = json.loads(self._map[start:start + self._invalid_size].decode("utf-8"))
+        return self._invalid
+
+    def _find(self, title_id):
+        try:
+            raw = bytes.fromhex(title_id)
+        except ValueError:
+            return None
+        i = bisect.bisect_left(self._index, raw)
+        if i < self.count and self._index[i] == raw:
+            return i
+        return None
+
+    def _offset(self, i):
+        return self._records_start + i * TIK_SIZE
+
+    def lookup(self, title_id):
+        """Returns the ticket of title_id as a memoryview into the cache, or None."""
+        i = self._find(title_id)
+        if i is None:
+            return None
+        start = self._offset(i)
+        return memoryview(self._map)[start:start + TIK_SIZE]
+
+    def write_ticket(self, title_id, output_path):
+        """
+        Writes title.tik for title_id into output_path straight from the cache.
+
+        Returns:
+            bool: False if title_id is not in the cache.
+        """
+        i = self._find(title_id)
+        if i is None:
+            return False
+
+        tik_path = os.path.join(output_path, "title.tik")
+        with open(tik_path, "wb") as f:
+            if hasattr(os, "copy_file_range"):
+                try:
+                    # Kernel side copy, the ticket never enters user space
+                    copied = os.copy_file_range(self._file.fileno(), f.fileno(), TIK_SIZE, self._offset(i))
+                    if copied == TIK_SIZE:
+                        return True
+                    f.seek(0)
+                    f.truncate()
+                except OSError:
+                    pass
+            with self.lookup(title_id) as record:
+                f.write(record)
+        return True
+
+
+def main(argv=None):
+    from wiiman.pipeline import TITLEKEYS_CSV, TICKET_CACHE
+
+    argv = sys.argv[1:] if argv is None else argv
+    csv_path = argv[0] if argv else TITLEKEYS_CSV
+    cache_path = argv[1] if len(argv) > 1 else TICKET_CACHE
+
+    logging.basicConfig(level=logging.INFO)
+    invalid = build_ticket_cache(csv_path, cache_path)
+    for line in format_invalid_rows(invalid):
+        print(line)
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+import os
+import re
+import json
+import shutil
+import logging
+from wiiman.tmd_parser import read_tmd_title_id
+from wiiman import memprofile
+from wiiman.output_writer import OutputWriter
+
+# 🧬 High half of the Title ID → layer type
+TITLE_TYPES = {
+    "00050000": "base",
+    "0005000E": "update",
+    "0005000C": "dlc",
+}
+
+# Layers are applied in this order, later ones override earlier ones
+LAYER_ORDER = ("base", "update", "dlc")
+
+# DLC ships its own code/ and meta/ which would clobber the game's, so it is
+# mounted under its own prefix in the merged tree
+LAYER_PREFIX = {
+    "base": "",
+    "update": "",
+    "dlc": "aoc",
+}
+
+MANIFEST_NAME = "layers.json"
+
+
+def title_type(title_id):
+    """Returns 'base', 'update', 'dlc' or None for a 16-char hex Title ID."""
+    return TITLE_TYPES.get(title_id[:8].upper())
+
+
+def title_family(title_id):
+    """Returns the low half of the Title ID shared by a game, its update and DLC."""
+    return title_id[8:].upper()
+
+
+def find_folder_tmd(folder):
+    """
+    Returns the TMD to read the Title ID from: title.tmd if present,
+    otherwise the highest numbered tmd.X alternate, or None.
+    """
+    title_tmd = os.path.join(folder, "title.tmd")
+    if os.path.isfile(title_tmd):
+        return title_tmd
+
+    alternates = [f for f in os.listdir(folder) if re.fullmatch(r'tmd\.\d+', f)]
+    if not alternates:
+        return None
+    latest = max(alternates, key=lambda f: int(f.split(".")[1]))
+    return os.path.join(folder, latest)
+
+
+def group_cdn_folders(folders):
+    """
+    Groups CDN folders by Title ID family.
+
+    Args:
+        folders (list): CDN folder paths
+
+    Returns:
+        dict: family (low Title ID half) → list of layer dicts
+              {"type", "title_id", "folder"} sorted in LAYER_ORDER.
+    """
+    families = {}
+    for folder in folders:
+        tmd_path = find_folder_tmd(folder)
+        if not tmd_path:
+            logging.warning(f"No TMD found in {folder}, skipping")
+            continue
+
+        title_id = read_tmd_title_id(tmd_path)
+        kind = title_type(title_id)
+        if kind is None:
+            logging.warning(f"Unknown title type {title_id} in {folder}, skipping")
+            continue
+
+        families.setdefault(title_family(title_id), []).append({
+            "type": kind,
+            "title_id": title_id,
+            "folder": folder,
+        })
+
+    for family, layers in families.items():
+        layers.sort(key=lambda layer: LAYER_ORDER.index(layer["type"]))
+        kinds = [layer["type"] for layer in layers]
+        if len(set(kinds)) != len(kinds):
+            logging.warning(f"Family {family} has several folders of the same type: {kinds}")
+
+    return families
+
+
+def load_manifest(merged_dir):
+    manifest_path = os.path.join(merged_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {"layers": [], "files": {}}
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(merged_dir, manifest):
+    manifest_path = os.path.join(merged_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def _place_file(src, dst, link):
+    """
+    Moves (or hardlinks) src to dst, replacing whatever is there.
+    Returns False when src and dst are on different filesystems.
+    """
+    try:
+        if link:
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            os.link(src, dst)
+        else:
+            os.replace(src, dst)
+        return True
+    except OSError as e:
+        logging.debug(f"{'Hardlink' if link else 'Rename'} failed for {src}: {e}")
+        return False
+
+
+def merge_layer(layer_dir, merged_dir, layer_id, manifest, prefix="", link=False, progress=None):
+    """
+    Merges a decrypted layer into merged_dir. Files already in the merged tree
+    are overridden and the manifest records which layer each file came from.
+
+    Args:
+        layer_dir (str): Decrypted layer (code/, content/, meta/)
+        merged_dir (str): Merged output tree
+        layer_id (str): Title ID recorded in the manifest
+        manifest (dict): Manifest as returned by load_manifest
+        prefix (str): Sub-folder of merged_dir to mount the layer under
+        link (bool): Hardlink instead of moving, leaving layer_dir intact
+        progress (Progress): Optional, receives the bytes of cross-filesystem copies
+
+    Returns:
+        int: Number of files merged.
+    """
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(layer_dir):
+        dirnames.sort()
+        rel_dir = os.path.relpath(dirpath, layer_dir)
+        for fname in sorted(filenames):
+            rel = os.path.normpath(os.path.join(prefix, rel_dir, fname))
+            entries.append((rel, os.path.join(dirpath, fname)))
+
+    # 📂 Create the whole directory set in one pass, copy only across filesystems.
+    # Files are moved by rename, so there is nothing worth an fsync per directory
+    with OutputWriter(merged_dir, durable=False, progress=progress) as writer:
+        writer.plan((rel, 0) for rel, _ in entries)
+
+        for rel, src in entries:
+            if not _place_file(src, os.path.join(merged_dir, rel), link):
+                writer.copy_file(rel, src)
+                if not link:
+                    os.remove(src)
+            manifest["files"][rel.replace(os.sep, "/")] = layer_id
+
+    return len(entries)
+
+
+def publish_output(staging_dir, final_dir, tag=None):
+    """
+    Moves a finished staging folder to final_dir with two renames: the old
+    output is renamed aside, then staging takes its place. This is not an
+    atomic swap, final_dir is briefly missing between the two renames. If
+    the second rename fails the old output is put back and the error raised.
+
+    Args:
+        staging_dir (str): Finished tree, on the same filesystem as final_dir
+        final_dir (str): Output to replace
+        tag (str): Makes the aside name unique per writer, defaults to the pid
+    """
+    old_dir = None
+    if os.path.exists(final_dir):
+        old_dir = f"{final_dir}.old-{tag or os.getpid()}"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.rename(final_dir, old_dir)
+    try:
+        os.rename(staging_dir, final_dir)
+    except OSError:
+        if old_dir:
+            os.rename(old_dir, final_dir)
+        raise
+    if old_dir:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def process_family(layers, output_dir, decrypt, progress):
+    """
+    Decrypts every layer of a title family in dependency order and merges
+    them into a single output tree.
+
+    The tree is built from scratch next to output_dir and only replaces it
+    once every layer succeeded, so a failed run leaves the previous output
+    and manifest as they were, and files dropped by a new version do not
+    linger. This needs room for a second copy of the title while it runs.
+
+    Args:
+        layers (list): Layer dicts as returned by group_cdn_folders
+        output_dir (str): Merged output tree
+        decrypt: Callable (layer, staging_dir) decrypting one layer
+        progress (Progress): Receives the progress events
+
+    Returns:
+        dict: The manifest written to output_dir.
+
+    Raises:
+        RuntimeError: A layer's decryption produced no files. output_dir is
+                      left untouched.
+    """
+    merged_dir = f"{os.path.normpath(output_dir)}.part-{os.getpid()}"
+    shutil.rmtree(merged_dir, ignore_errors=True)
+    os.makedirs(merged_dir)
+    manifest = {"layers": [], "files": {}}
+
+    try:
+        for layer in layers:
+            # 🧱 Staging lives inside the merged tree so merging is a plain rename
+            staging = os.path.join(merged_dir, f".layer_{layer['title_id']}")
+            os.makedirs(staging)
+            try:
+                decrypt(layer, staging)
+                if not os.listdir(staging):
+                    raise RuntimeError(f"Decryption of {layer['type']} {layer['title_id']} produced no output")
+                with progress.stage(f"merge {layer['type']}"), memprofile.stage("merge"):
+                    count = merge_layer(
+                        staging, merged_dir, layer["title_id"], manifest,
+                        prefix=LAYER_PREFIX[layer["type"]], progress=progress
+                    )
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+
+            manifest["layers"].append({"type": layer["type"], "title_id": layer["title_id"]})
+            progress.info(f"🧩 Merged {count} file(s) from {layer['type']} {layer['title_id']}")
+
+        write_manifest(merged_dir, manifest)
+        publish_output(merged_dir, output_dir)
+    except BaseException:
+        shutil.rmtree(merged_dir, ignore_errors=True)
+        raise
+
+    return manifest
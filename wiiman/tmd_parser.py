@@ -9,4 +9,44 @@ def read_tmd_title_id(tmd_path):
         f.seek(0x18C)  # Title ID offset in TMD (14th byte of issuer section)
         title_id_raw = f.read(8)  # Title ID is 8 bytes
         title_id_hex = ''.join(f"{b:02X}" for b in title_id_raw)
-        return title_id_hex
\ No newline at end of file
+        return title_id_hex
+
+def read_tmd_version(tmd_path):
+    with open(tmd_path, "rb") as f:
+        f.seek(0x1DC)  # Title version
+        return struct.unpack(">H", f.read(2))[0]
+
+
+def read_tmd_contents(tmd_path):
+    """
+    Reads the content records of a TMD.
+
+    Returns:
+        list: One dict per content with "id" (8-char hex), "index", "type",
+              "size" and "hash" (SHA-1 hex).
+    """
+    if not os.path.exists(tmd_path):
+        raise FileNotFoundError("title.tmd not found at specified path.")
+
+    with open(tmd_path, "rb") as f:
+        data = f.read()
+
+    if len(data) < 0xB04:
+        raise ValueError("TMD is truncated: header is incomplete.")
+
+    count = struct.unpack_from(">H", data, 0x1DE)[0]  # Content count
+    records_end = 0xB04 + count * 0x30
+    if len(data) < records_end:
+        raise ValueError(f"TMD is truncated: expected {count} content records.")
+
+    contents = []
+    for offset in range(0xB04, records_end, 0x30):  # 0x30 bytes per record
+        content_id, index, content_type, size = struct.unpack_from(">IHHQ", data, offset)
+        contents.append({
+            "id": f"{content_id:08X}",
+            "index": index,
+            "type": content_type,
+            "size": size,
+            "hash": data[offset + 0x10:offset + 0x24].hex().upper(),
+        })
+    return contents